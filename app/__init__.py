@@ -8,21 +8,73 @@ Versión 2.0 - Refactorizada con autenticación y gestión de equipos
 from flask import Flask
 from flask_jwt_extended import JWTManager
 from datetime import timedelta
+from cachetools import TTLCache
+import hashlib
+import threading
+import time
 import os
 
-jwt = JWTManager()
+from app.database import liberar_conexion_request
+from app.routes.auth import auth_bp
+from app.routes.api import api_bp
+from app.routes.dashboard import dashboard_bp
+from app.routes.admin import admin_bp
+from app.services.json_provider import crear_provider
+
+JWT_CACHE_TTL = int(os.environ.get('JWT_CACHE_TTL', 5))
+
+
+class CachedJWTManager(JWTManager):
+    """
+    JWTManager que memoriza los claims decodificados durante unos segundos.
+    
+    Evita repetir la verificación HMAC + base64 + JSON en cada request del
+    mismo navegador/dispositivo. La firma y la expiración se validan en el
+    primer decode; las entradas nunca sobreviven al 'exp' del token. El
+    chequeo de tipo de token y de blocklist sigue ejecutándose por request,
+    así que la única ventana de inconsistencia es de JWT_CACHE_TTL segundos
+    (p.ej. al rotar JWT_SECRET_KEY). JWT_CACHE_TTL=0 desactiva la caché.
+    """
+    
+    def __init__(self, app=None, ttl: int = JWT_CACHE_TTL):
+        self._claims_cache = TTLCache(maxsize=10000, ttl=ttl) if ttl > 0 else None
+        self._claims_lock = threading.Lock()
+        super().__init__(app)
+    
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        if self._claims_cache is None or csrf_value is not None or allow_expired:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        
+        key = hashlib.sha256(encoded_token.encode()).digest()[:16]
+        with self._claims_lock:
+            claims = self._claims_cache.get(key)
+        if claims is not None and claims.get('exp', 0) > time.time():
+            return claims
+        
+        claims = super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        with self._claims_lock:
+            self._claims_cache[key] = claims
+        return claims
+
+
+jwt = CachedJWTManager()
 
 def create_app():
     app = Flask(__name__, 
                 template_folder='../templates',
                 static_folder='../static')
     
+    # JSON con fechas ISO-8601 (orjson si está instalado)
+    app.json = crear_provider(app)
+    
     # Detectar si estamos en producción (Render u otro hosting)
     is_production = os.environ.get('RENDER') or os.environ.get('DATABASE_URL', '').startswith('postgresql')
     
     # Configuración
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
     app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-key-change-in-production')
+    # HS256 explícito: verificar es un HMAC-SHA256, sin criptografía asimétrica
+    app.config['JWT_ALGORITHM'] = 'HS256'
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=8)
     app.config['JWT_TOKEN_LOCATION'] = ['cookies', 'headers']
     
@@ -35,13 +87,9 @@ def create_app():
     
     # Inicializar extensiones
     jwt.init_app(app)
+    app.teardown_request(liberar_conexion_request)
     
     # Registrar blueprints
-    from app.routes.auth import auth_bp
-    from app.routes.api import api_bp
-    from app.routes.dashboard import dashboard_bp
-    from app.routes.admin import admin_bp
-    
     app.register_blueprint(auth_bp)
     app.register_blueprint(api_bp, url_prefix='/api')
     app.register_blueprint(dashboard_bp)
@@ -5,289 +5,744 @@ Incluye: Usuarios, Plantas, Equipos, Series de Equipos, Patrimonio
 ================================================================================
 """
 
+import io
 import os
+import math
+import time
+import atexit
+import operator
+import hashlib
+import uuid
+import queue
 import logging
-from datetime import datetime
+import threading
+from datetime import date, datetime, timedelta
+from collections import Counter
 from contextlib import contextmanager
-from typing import Optional, List, Dict, Any
-from statistics import mean, stdev
+from functools import lru_cache
+from typing import Optional, List, Dict, Any, Iterator, Tuple
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.extensions
+from psycopg2 import sql
+from cachetools import TTLCache
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from werkzeug.security import generate_password_hash, check_password_hash
 
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: sin él se usa Python puro
+    np = None
+
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import VerificationError, InvalidHashError
+except ImportError:  # argon2-cffi es opcional: sin él se usa PBKDF2 de Werkzeug
+    PasswordHasher = None
+
+from flask import g, has_request_context
+
+from app.services import cache, stats_cache
+
 logger = logging.getLogger(__name__)
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "")
+# Render/Heroku entregan postgres://, libpq prefiere postgresql://
+_NORMALIZED_URL = (DATABASE_URL.replace("postgres://", "postgresql://", 1)
+                   if DATABASE_URL.startswith("postgres://") else DATABASE_URL)
+PG_POOL_MIN = int(os.environ.get("PG_POOL_MIN", 2))
+PG_POOL_MAX = int(os.environ.get("PG_POOL_MAX", 20))
+# Segundos tras los que una conexión del pool se cierra y se reabre
+PG_POOL_RECYCLE = int(os.environ.get("PG_POOL_RECYCLE", 1800))
+
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+# Caché de usuarios para el camino de autenticación (se invalida al escribir).
+# Por ID va a la caché compartida: con Redis la invalidación llega a todos los
+# workers; sin Redis cada worker la retiene como mucho CACHE_TTL_LOCAL_MAX.
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 300))
+_telegram_cache = TTLCache(maxsize=5000, ttl=60)
+_user_lock = threading.Lock()
+
+# Hash de contraseñas: argon2id si está instalado; si no, PBKDF2 con método fijo
+# para no depender del default de Werkzeug. Los hashes PBKDF2 existentes se
+# migran a argon2id en el siguiente login correcto.
+PASSWORD_HASH_METHOD = "pbkdf2:sha256:600000"
+_argon2 = (PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=2)
+           if PasswordHasher is not None else None)
+
+# Caché de logins recientes (opt-in: LOGIN_CACHE_TTL=0 la desactiva). Solo evita
+# recalcular el hash: activo y password_hash se leen siempre de la BD
+LOGIN_CACHE_TTL = int(os.environ.get("LOGIN_CACHE_TTL", 0))
+_login_cache = TTLCache(maxsize=1000, ttl=LOGIN_CACHE_TTL or 1)
+
+# Caché corta de plantas individuales (polling del dashboard)
+_planta_cache = TTLCache(maxsize=256, ttl=2)
+_planta_lock = threading.Lock()
+
+# Listados de plantas: la telemetría no los invalida, se refrescan al expirar
+PLANTAS_TTL = 10
+
+# Escritura diferida del historial de monitoreo
+HIST_FLUSH_MS = int(os.environ.get("HIST_FLUSH_MS", 500))
+HIST_BATCH = int(os.environ.get("HIST_BATCH", 1000))
+
+_hist_queue: "queue.SimpleQueue[tuple]" = queue.SimpleQueue()
+# Marca en la cola para que el writer escriba lo que tiene y termine
+_HIST_FIN = None
+_hist_writer: Optional[threading.Thread] = None
+_hist_writer_lock = threading.Lock()
+
+# Meses de particiones de historial que se crean por adelantado
+HIST_MESES_ADELANTE = 1
+_hist_mes_listo: Optional[date] = None
+
+# Filas por viaje al leer historial con cursor del lado del servidor
+HIST_ITERSIZE = int(os.environ.get("HIST_ITERSIZE", 2000))
+# Por debajo de este LIMIT conviene un cursor normal (un solo round-trip)
+HIST_CURSOR_SERVIDOR_MIN = 10_000
 
 # ================================================================================
 # CONEXIÓN
 # ================================================================================
 
+class _Conexion(psycopg2.extensions.connection):
+    """Conexión que recuerda qué statements ya preparó en su sesión"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparados = set()
+        self.creada = time.monotonic()
+
+
+# Consultas frecuentes que se preparan una vez por conexión (PREPARE/EXECUTE)
+_SENTENCIAS = {
+    "get_planta": "SELECT * FROM plantas WHERE id = $1",
+    "get_usuario_por_id": """
+        SELECT id, username, rol, nombre_completo, email, telegram_id, activo,
+               ultimo_acceso, created_at
+        FROM usuarios WHERE id = $1
+    """,
+    "get_usuario_login": """
+        SELECT id, username, password_hash, rol, nombre_completo, email, telegram_id, activo
+        FROM usuarios WHERE username = $1
+    """,
+    "upsert_monitoreo": """
+        WITH anterior AS (SELECT alarma FROM plantas WHERE id = $1)
+        INSERT INTO plantas (id, nombre, presion_bar, temperatura_c, pureza_pct,
+                            flujo_nm3h, horas_operacion, modo, alarma,
+                            mensaje_alarma, ultima_actualizacion)
+        VALUES ($1, COALESCE($2, $3), $4, $5, $6, $7, COALESCE($8, 0), $9, $10, $11, $12)
+        ON CONFLICT (id) DO UPDATE SET
+            nombre = COALESCE($2, plantas.nombre),
+            presion_bar = EXCLUDED.presion_bar,
+            temperatura_c = EXCLUDED.temperatura_c,
+            pureza_pct = EXCLUDED.pureza_pct,
+            flujo_nm3h = EXCLUDED.flujo_nm3h,
+            horas_operacion = COALESCE($8, plantas.horas_operacion),
+            modo = EXCLUDED.modo,
+            alarma = EXCLUDED.alarma,
+            mensaje_alarma = EXCLUDED.mensaje_alarma,
+            ultima_actualizacion = EXCLUDED.ultima_actualizacion
+        RETURNING ultima_actualizacion,
+                  COALESCE((SELECT alarma FROM anterior), FALSE) AS alarma_anterior
+    """,
+}
+
+
+def _ejecutar_preparado(cursor, nombre: str, params: tuple):
+    """Ejecuta un statement de _SENTENCIAS preparándolo si la conexión aún no lo tiene"""
+    conn = cursor.connection
+    if nombre not in conn.preparados:
+        cursor.execute(f"PREPARE {nombre} AS {_SENTENCIAS[nombre]}")
+        conn.preparados.add(nombre)
+    placeholders = ", ".join(["%s"] * len(params))
+    cursor.execute(f"EXECUTE {nombre} ({placeholders})", params)
+
+
+def init_pool() -> ThreadedConnectionPool:
+    """Crea el pool de conexiones del proceso (idempotente)"""
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    
+    with _pool_lock:
+        # Tras un fork (gunicorn --preload) las conexiones heredadas son del
+        # master: se descartan y el worker abre las suyas
+        if _pool is None or _pool_pid != os.getpid():
+            if not _NORMALIZED_URL:
+                raise Exception("DATABASE_URL no configurada")
+            
+            _pool = ThreadedConnectionPool(
+                PG_POOL_MIN, PG_POOL_MAX, _NORMALIZED_URL,
+                connection_factory=_Conexion, cursor_factory=RealDictCursor
+            )
+            _pool_pid = os.getpid()
+            logger.info(f"Pool PostgreSQL creado (min={PG_POOL_MIN}, max={PG_POOL_MAX})")
+    return _pool
+
+
+def cerrar_pool():
+    """Cierra el pool de este proceso (p.ej. el master de gunicorn tras inicializar)"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = _pool_pid = None
+
+
+def _tomar_conexion(pool: ThreadedConnectionPool):
+    """getconn descartando conexiones cerradas o con más de PG_POOL_RECYCLE segundos"""
+    while True:
+        conn = pool.getconn()
+        if not conn.closed and time.monotonic() - conn.creada < PG_POOL_RECYCLE:
+            return conn
+        pool.putconn(conn, close=True)
+
+
+def _devolver_conexion(pool: ThreadedConnectionPool, conn):
+    """putconn cerrando las conexiones que quedaron rotas (servidor caído, red)"""
+    rota = (conn.closed or conn.info.transaction_status
+            == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN)
+    pool.putconn(conn, close=bool(rota))
+
+
 def get_db_connection():
-    """Obtiene conexión a PostgreSQL"""
-    if not DATABASE_URL:
-        raise Exception("DATABASE_URL no configurada")
+    """Obtiene una conexión del pool"""
+    return _tomar_conexion(init_pool())
+
+
+def _conexion_request():
+    """Conexión reservada para el request actual, si hay request y está libre"""
+    if not has_request_context() or g.get('_db_en_uso'):
+        return None
     
-    url = DATABASE_URL
-    if url.startswith("postgres://"):
-        url = url.replace("postgres://", "postgresql://", 1)
+    conn = g.get('_db_conn')
+    if conn is None or conn.closed:
+        if conn is not None:
+            init_pool().putconn(conn, close=True)
+        conn = g._db_conn = _tomar_conexion(init_pool())
+    g._db_en_uso = True
+    return conn
+
+
+def liberar_conexion_request(exc=None):
+    """teardown_request: devuelve al pool la conexión del request"""
+    conn = g.pop('_db_conn', None)
+    g.pop('_db_en_uso', None)
+    if conn is not None:
+        _devolver_conexion(init_pool(), conn)
+
+
+@contextmanager
+def _prestar_conexion():
+    """Usa la conexión del request si está libre; si no, una del pool"""
+    conn = _conexion_request()
+    if conn is not None:
+        try:
+            yield conn
+        finally:
+            g._db_en_uso = False
+        return
     
-    return psycopg2.connect(url, cursor_factory=RealDictCursor)
+    with _conexion_pool() as conn:
+        yield conn
 
 
 @contextmanager
-def get_db():
-    """Context manager para conexiones"""
-    conn = get_db_connection()
+def _conexion_pool():
+    """Conexión tomada directamente del pool (sin pasar por la del request)"""
+    pool = init_pool()
+    conn = _tomar_conexion(pool)
     try:
         yield conn
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
     finally:
-        conn.close()
+        _devolver_conexion(pool, conn)
+
+
+@contextmanager
+def get_db():
+    """Context manager para conexiones (commit al salir, rollback ante error)"""
+    with _prestar_conexion() as conn:
+        try:
+            yield conn
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+
+
+@contextmanager
+def get_db_ro():
+    """Conexión en autocommit para consultas de solo lectura (sin BEGIN/COMMIT)"""
+    with _prestar_conexion() as conn:
+        conn.autocommit = True
+        try:
+            yield conn
+        finally:
+            if not conn.closed:
+                conn.autocommit = False
 
 
 # ================================================================================
 # INICIALIZACIÓN DE TABLAS
 # ================================================================================
 
-def inicializar_db():
-    """Crea todas las tablas necesarias"""
-    with get_db() as conn:
-        cursor = conn.cursor()
+# Lock consultivo para que un solo worker ejecute la DDL a la vez
+_DDL_LOCK_ID = 727344
+
+_DDL_SCHEMA = """
+    -- ============ VERSIÓN DEL ESQUEMA ============
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version VARCHAR(40) NOT NULL
+    );
+
+    -- ============ USUARIOS ============
+    CREATE TABLE IF NOT EXISTS usuarios (
+        id SERIAL PRIMARY KEY,
+        username VARCHAR(50) UNIQUE NOT NULL,
+        email VARCHAR(100) UNIQUE,
+        password_hash VARCHAR(255) NOT NULL,
+        nombre_completo VARCHAR(100),
+        rol VARCHAR(20) DEFAULT 'lector' CHECK (rol IN ('admin', 'operador', 'lector')),
+        telegram_id BIGINT UNIQUE,
+        activo BOOLEAN DEFAULT TRUE,
+        ultimo_acceso TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- ============ PLANTAS (AMPLIADA) ============
+    CREATE TABLE IF NOT EXISTS plantas (
+        id VARCHAR(50) PRIMARY KEY,
+        nombre VARCHAR(100) NOT NULL,
+        codigo_interno VARCHAR(50) UNIQUE,
+        ubicacion VARCHAR(200) DEFAULT '',
+        direccion VARCHAR(200),
+        ciudad VARCHAR(100),
+        departamento VARCHAR(100),
         
-        # ============ USUARIOS ============
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS usuarios (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(50) UNIQUE NOT NULL,
-                email VARCHAR(100) UNIQUE,
-                password_hash VARCHAR(255) NOT NULL,
-                nombre_completo VARCHAR(100),
-                rol VARCHAR(20) DEFAULT 'lector' CHECK (rol IN ('admin', 'operador', 'lector')),
-                telegram_id BIGINT UNIQUE,
-                activo BOOLEAN DEFAULT TRUE,
-                ultimo_acceso TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        -- Datos administrativos
+        numero_patrimonio VARCHAR(50) UNIQUE,
+        responsable VARCHAR(100),
+        telefono_contacto VARCHAR(50),
+        email_contacto VARCHAR(100),
         
-        # ============ PLANTAS (AMPLIADA) ============
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS plantas (
-                id VARCHAR(50) PRIMARY KEY,
-                nombre VARCHAR(100) NOT NULL,
-                codigo_interno VARCHAR(50) UNIQUE,
-                ubicacion VARCHAR(200) DEFAULT '',
-                direccion VARCHAR(200),
-                ciudad VARCHAR(100),
-                departamento VARCHAR(100),
-                
-                -- Datos administrativos
-                numero_patrimonio VARCHAR(50) UNIQUE,
-                responsable VARCHAR(100),
-                telefono_contacto VARCHAR(50),
-                email_contacto VARCHAR(100),
-                
-                -- Configuración
-                tipo_instalacion VARCHAR(50) DEFAULT 'simplex' CHECK (tipo_instalacion IN ('simplex', 'duplex', 'triplex')),
-                capacidad_nominal_nm3h REAL,
-                fecha_instalacion DATE,
-                fecha_ultimo_mantenimiento DATE,
-                proximo_mantenimiento DATE,
-                
-                -- Estado operativo (actualizado por monitoreo)
-                presion_bar REAL DEFAULT 0,
-                temperatura_c REAL DEFAULT 0,
-                pureza_pct REAL DEFAULT 0,
-                flujo_nm3h REAL DEFAULT 0,
-                horas_operacion INTEGER DEFAULT 0,
-                modo VARCHAR(50) DEFAULT 'Desconocido',
-                alarma BOOLEAN DEFAULT FALSE,
-                mensaje_alarma TEXT DEFAULT '',
-                ultima_actualizacion TIMESTAMP,
-                
-                -- Metadatos
-                estado VARCHAR(20) DEFAULT 'activa' CHECK (estado IN ('activa', 'inactiva', 'mantenimiento', 'baja')),
-                notas TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                activa BOOLEAN DEFAULT TRUE
-            )
-        """)
+        -- Configuración
+        tipo_instalacion VARCHAR(50) DEFAULT 'simplex' CHECK (tipo_instalacion IN ('simplex', 'duplex', 'triplex')),
+        capacidad_nominal_nm3h REAL,
+        fecha_instalacion DATE,
+        fecha_ultimo_mantenimiento DATE,
+        proximo_mantenimiento DATE,
         
-        # ============ TIPOS DE EQUIPO ============
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS tipos_equipo (
-                id SERIAL PRIMARY KEY,
-                codigo VARCHAR(20) UNIQUE NOT NULL,
-                nombre VARCHAR(100) NOT NULL,
-                descripcion TEXT,
-                icono VARCHAR(10) DEFAULT '⚙️',
-                orden_display INTEGER DEFAULT 0
-            )
-        """)
+        -- Estado operativo (actualizado por monitoreo)
+        presion_bar REAL DEFAULT 0,
+        temperatura_c REAL DEFAULT 0,
+        pureza_pct REAL DEFAULT 0,
+        flujo_nm3h REAL DEFAULT 0,
+        horas_operacion INTEGER DEFAULT 0,
+        modo VARCHAR(50) DEFAULT 'Desconocido',
+        alarma BOOLEAN DEFAULT FALSE,
+        mensaje_alarma TEXT DEFAULT '',
+        ultima_actualizacion TIMESTAMP,
         
-        # Insertar tipos de equipo predefinidos
-        tipos_equipo = [
-            ('COMP_AIRE', 'Compresor de Aire', 'Compresor de aire para alimentación del sistema', '🌀', 1),
-            ('SECADOR', 'Secador de Aire', 'Secador de aire por refrigeración o adsorción', '💨', 2),
-            ('PSA', 'Generador PSA', 'Generador de oxígeno por adsorción PSA', '🫁', 3),
-            ('GEN_ELEC', 'Generador Eléctrico', 'Generador eléctrico de respaldo', '⚡', 4),
-            ('COMP_O2', 'Compresor de O2', 'Compresor de alta presión para llenado de balones', '🔵', 5),
-            ('TANQUE', 'Tanque de Almacenamiento', 'Tanque buffer o de almacenamiento de O2', '🛢️', 6),
-            ('ANALIZADOR', 'Analizador de O2', 'Analizador/sensor de pureza de oxígeno', '📊', 7),
-            ('OTRO', 'Otro', 'Otro tipo de equipo', '🔧', 99),
-        ]
+        -- Metadatos
+        estado VARCHAR(20) DEFAULT 'activa' CHECK (estado IN ('activa', 'inactiva', 'mantenimiento', 'baja')),
+        notas TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        activa BOOLEAN DEFAULT TRUE
+    );
+
+    -- ============ TIPOS DE EQUIPO ============
+    CREATE TABLE IF NOT EXISTS tipos_equipo (
+        id SERIAL PRIMARY KEY,
+        codigo VARCHAR(20) UNIQUE NOT NULL,
+        nombre VARCHAR(100) NOT NULL,
+        descripcion TEXT,
+        icono VARCHAR(10) DEFAULT '⚙️',
+        orden_display INTEGER DEFAULT 0
+    );
+
+    -- ============ SERIES DE EQUIPO (MODELOS) ============
+    CREATE TABLE IF NOT EXISTS series_equipo (
+        id SERIAL PRIMARY KEY,
+        tipo_equipo_id INTEGER REFERENCES tipos_equipo(id),
+        fabricante VARCHAR(100) NOT NULL,
+        modelo VARCHAR(100) NOT NULL,
+        descripcion TEXT,
         
-        for codigo, nombre, desc, icono, orden in tipos_equipo:
-            cursor.execute("""
-                INSERT INTO tipos_equipo (codigo, nombre, descripcion, icono, orden_display)
-                VALUES (%s, %s, %s, %s, %s)
-                ON CONFLICT (codigo) DO NOTHING
-            """, (codigo, nombre, desc, icono, orden))
+        -- Especificaciones técnicas (JSON flexible)
+        especificaciones JSONB DEFAULT '{}',
         
-        # ============ SERIES DE EQUIPO (MODELOS) ============
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS series_equipo (
-                id SERIAL PRIMARY KEY,
-                tipo_equipo_id INTEGER REFERENCES tipos_equipo(id),
-                fabricante VARCHAR(100) NOT NULL,
-                modelo VARCHAR(100) NOT NULL,
-                descripcion TEXT,
-                
-                -- Especificaciones técnicas (JSON flexible)
-                especificaciones JSONB DEFAULT '{}',
-                
-                -- Documentación
-                manual_url VARCHAR(500),
-                imagen_url VARCHAR(500),
-                
-                -- Metadatos
-                activo BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                
-                UNIQUE(fabricante, modelo)
-            )
-        """)
+        -- Documentación
+        manual_url VARCHAR(500),
+        imagen_url VARCHAR(500),
         
-        # ============ EQUIPOS ============
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS equipos (
-                id SERIAL PRIMARY KEY,
-                planta_id VARCHAR(50) REFERENCES plantas(id) ON DELETE CASCADE,
-                tipo_equipo_id INTEGER REFERENCES tipos_equipo(id),
-                serie_equipo_id INTEGER REFERENCES series_equipo(id),
-                
-                -- Identificación
-                nombre VARCHAR(100) NOT NULL,
-                numero_serie VARCHAR(100),
-                numero_patrimonio VARCHAR(50) UNIQUE,
-                tag VARCHAR(50),  -- Ej: COMP-01, PSA-A, etc.
-                
-                -- Detalles
-                marca VARCHAR(100),
-                modelo VARCHAR(100),
-                año_fabricacion INTEGER,
-                
-                -- Ubicación dentro de la planta
-                ubicacion_interna VARCHAR(100),  -- Ej: "Sala de compresores", "Línea A"
-                posicion INTEGER DEFAULT 1,  -- Para plantas duplex: 1=primario, 2=secundario
-                
-                -- Estado
-                estado VARCHAR(30) DEFAULT 'operativo' CHECK (estado IN ('operativo', 'standby', 'mantenimiento', 'fuera_servicio', 'baja')),
-                criticidad VARCHAR(10) DEFAULT 'media' CHECK (criticidad IN ('baja', 'media', 'alta', 'critica')),
-                
-                -- Fechas
-                fecha_instalacion DATE,
-                fecha_ultimo_mantenimiento DATE,
-                proximo_mantenimiento DATE,
-                fecha_baja DATE,
-                
-                -- Horas de operación (si aplica)
-                horas_operacion INTEGER DEFAULT 0,
-                horas_proximo_servicio INTEGER,
-                
-                -- Notas
-                notas TEXT,
-                
-                -- Metadatos
-                activo BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        -- Metadatos
+        activo BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         
-        # ============ HISTORIAL DE MONITOREO ============
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS historial (
-                id SERIAL PRIMARY KEY,
-                planta_id VARCHAR(50) NOT NULL,
-                timestamp TIMESTAMP NOT NULL,
-                presion_bar REAL,
-                temperatura_c REAL,
-                pureza_pct REAL,
-                flujo_nm3h REAL,
-                modo VARCHAR(50),
-                alarma BOOLEAN DEFAULT FALSE,
-                mensaje_alarma TEXT,
-                horas_operacion INTEGER DEFAULT 0
-            )
-        """)
+        UNIQUE(fabricante, modelo)
+    );
+
+    -- ============ EQUIPOS ============
+    CREATE TABLE IF NOT EXISTS equipos (
+        id SERIAL PRIMARY KEY,
+        planta_id VARCHAR(50) REFERENCES plantas(id) ON DELETE CASCADE,
+        tipo_equipo_id INTEGER REFERENCES tipos_equipo(id),
+        serie_equipo_id INTEGER REFERENCES series_equipo(id),
         
-        # ============ HISTORIAL DE EQUIPOS (MOVIMIENTOS) ============
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS historial_equipos (
-                id SERIAL PRIMARY KEY,
-                equipo_id INTEGER REFERENCES equipos(id) ON DELETE CASCADE,
-                tipo_evento VARCHAR(50) NOT NULL,  -- 'instalacion', 'mantenimiento', 'traslado', 'baja', 'reparacion'
-                fecha_evento TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                descripcion TEXT,
-                usuario_id INTEGER REFERENCES usuarios(id),
-                planta_origen_id VARCHAR(50),
-                planta_destino_id VARCHAR(50),
-                datos_adicionales JSONB DEFAULT '{}'
-            )
-        """)
+        -- Identificación
+        nombre VARCHAR(100) NOT NULL,
+        numero_serie VARCHAR(100),
+        numero_patrimonio VARCHAR(50) UNIQUE,
+        tag VARCHAR(50),  -- Ej: COMP-01, PSA-A, etc.
         
-        # ============ CONFIGURACIÓN DE ALERTAS ============
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS config_alertas (
-                id SERIAL PRIMARY KEY,
-                planta_id VARCHAR(50) UNIQUE REFERENCES plantas(id) ON DELETE CASCADE,
-                intervalo_alerta_min INTEGER DEFAULT 5,
-                alertas_activas BOOLEAN DEFAULT TRUE,
-                pureza_minima REAL DEFAULT 93.0,
-                presion_maxima REAL DEFAULT 7.0,
-                temperatura_maxima REAL DEFAULT 45.0,
-                notificar_telegram BOOLEAN DEFAULT TRUE,
-                notificar_email BOOLEAN DEFAULT FALSE,
-                emails_notificacion TEXT  -- Lista separada por comas
-            )
-        """)
+        -- Detalles
+        marca VARCHAR(100),
+        modelo VARCHAR(100),
+        año_fabricacion INTEGER,
+        
+        -- Ubicación dentro de la planta
+        ubicacion_interna VARCHAR(100),  -- Ej: "Sala de compresores", "Línea A"
+        posicion INTEGER DEFAULT 1,  -- Para plantas duplex: 1=primario, 2=secundario
+        
+        -- Estado
+        estado VARCHAR(30) DEFAULT 'operativo' CHECK (estado IN ('operativo', 'standby', 'mantenimiento', 'fuera_servicio', 'baja')),
+        criticidad VARCHAR(10) DEFAULT 'media' CHECK (criticidad IN ('baja', 'media', 'alta', 'critica')),
+        
+        -- Fechas
+        fecha_instalacion DATE,
+        fecha_ultimo_mantenimiento DATE,
+        proximo_mantenimiento DATE,
+        fecha_baja DATE,
+        
+        -- Horas de operación (si aplica)
+        horas_operacion INTEGER DEFAULT 0,
+        horas_proximo_servicio INTEGER,
+        
+        -- Notas
+        notas TEXT,
+        
+        -- Metadatos
+        activo BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- ============ HISTORIAL DE MONITOREO ============
+    -- Particionada por mes (las particiones se crean desde Python)
+    CREATE TABLE IF NOT EXISTS historial (
+        id SERIAL,
+        planta_id VARCHAR(50) NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        presion_bar REAL,
+        temperatura_c REAL,
+        pureza_pct REAL,
+        flujo_nm3h REAL,
+        modo VARCHAR(50),
+        alarma BOOLEAN DEFAULT FALSE,
+        mensaje_alarma TEXT,
+        horas_operacion INTEGER DEFAULT 0,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+
+    -- ============ HISTORIAL DE EQUIPOS (MOVIMIENTOS) ============
+    CREATE TABLE IF NOT EXISTS historial_equipos (
+        id SERIAL PRIMARY KEY,
+        equipo_id INTEGER REFERENCES equipos(id) ON DELETE CASCADE,
+        tipo_evento VARCHAR(50) NOT NULL,  -- 'instalacion', 'mantenimiento', 'traslado', 'baja', 'reparacion'
+        fecha_evento TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        descripcion TEXT,
+        usuario_id INTEGER REFERENCES usuarios(id),
+        planta_origen_id VARCHAR(50),
+        planta_destino_id VARCHAR(50),
+        datos_adicionales JSONB DEFAULT '{}'
+    );
+
+    -- ============ CONFIGURACIÓN DE ALERTAS ============
+    CREATE TABLE IF NOT EXISTS config_alertas (
+        id SERIAL PRIMARY KEY,
+        planta_id VARCHAR(50) UNIQUE REFERENCES plantas(id) ON DELETE CASCADE,
+        intervalo_alerta_min INTEGER DEFAULT 5,
+        alertas_activas BOOLEAN DEFAULT TRUE,
+        pureza_minima REAL DEFAULT 93.0,
+        presion_maxima REAL DEFAULT 7.0,
+        temperatura_maxima REAL DEFAULT 45.0,
+        notificar_telegram BOOLEAN DEFAULT TRUE,
+        notificar_email BOOLEAN DEFAULT FALSE,
+        emails_notificacion TEXT  -- Lista separada por comas
+    );
+
+    -- ============ ÍNDICES ============
+    CREATE INDEX IF NOT EXISTS idx_historial_planta ON historial(planta_id);
+    CREATE INDEX IF NOT EXISTS idx_hist_ts_brin ON historial USING BRIN (timestamp)
+        WITH (pages_per_range = 32);
+    CREATE INDEX IF NOT EXISTS idx_historial_planta_ts ON historial(planta_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_equipos_planta ON equipos(planta_id);
+    CREATE INDEX IF NOT EXISTS idx_equipos_tipo ON equipos(tipo_equipo_id);
+    CREATE INDEX IF NOT EXISTS idx_equipos_patrimonio ON equipos(numero_patrimonio);
+    CREATE INDEX IF NOT EXISTS idx_plantas_patrimonio ON plantas(numero_patrimonio);
+    CREATE INDEX IF NOT EXISTS idx_usuarios_telegram ON usuarios(telegram_id);
+    CREATE INDEX IF NOT EXISTS idx_series_tipo_fab_mod ON series_equipo(tipo_equipo_id, fabricante, modelo)
+        WHERE activo = TRUE;
+    CREATE INDEX IF NOT EXISTS idx_tipos_orden ON tipos_equipo(orden_display);
+    CREATE INDEX IF NOT EXISTS idx_equipos_planta_tipo_orden
+        ON equipos(planta_id, tipo_equipo_id, posicion, nombre) WHERE activo = TRUE;
+
+    -- Patrimonio único entre registros activos (se omite si ya hay duplicados)
+    DO $$
+    BEGIN
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_plantas_patrimonio_activa
+            ON plantas(numero_patrimonio) WHERE activa;
+    EXCEPTION WHEN unique_violation THEN
+        RAISE NOTICE 'Hay plantas activas con patrimonio duplicado: no se crea el índice único';
+    END $$;
+    DO $$
+    BEGIN
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_equipos_patrimonio_activo
+            ON equipos(numero_patrimonio) WHERE activo;
+    EXCEPTION WHEN unique_violation THEN
+        RAISE NOTICE 'Hay equipos activos con patrimonio duplicado: no se crea el índice único';
+    END $$;
+
+    -- Búsqueda ILIKE '%...%' por patrimonio (pg_trgm puede no estar instalado
+    -- (sin contrib) o no estar permitido: en ambos casos se sigue sin índice)
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        ELSE
+            RAISE NOTICE 'pg_trgm no instalado: la búsqueda por patrimonio no usará índice';
+        END IF;
+    EXCEPTION WHEN OTHERS THEN
+        RAISE NOTICE 'pg_trgm no disponible (%): la búsqueda por patrimonio no usará índice', SQLERRM;
+    END $$;
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+            CREATE INDEX IF NOT EXISTS idx_plantas_patrimonio_trgm
+                ON plantas USING gin (numero_patrimonio gin_trgm_ops);
+            CREATE INDEX IF NOT EXISTS idx_equipos_patrimonio_trgm
+                ON equipos USING gin (numero_patrimonio gin_trgm_ops);
+        END IF;
+    END $$;
+"""
+
+
+# Tipos de equipo predefinidos
+_TIPOS_EQUIPO = [
+    ('COMP_AIRE', 'Compresor de Aire', 'Compresor de aire para alimentación del sistema', '🌀', 1),
+    ('SECADOR', 'Secador de Aire', 'Secador de aire por refrigeración o adsorción', '💨', 2),
+    ('PSA', 'Generador PSA', 'Generador de oxígeno por adsorción PSA', '🫁', 3),
+    ('GEN_ELEC', 'Generador Eléctrico', 'Generador eléctrico de respaldo', '⚡', 4),
+    ('COMP_O2', 'Compresor de O2', 'Compresor de alta presión para llenado de balones', '🔵', 5),
+    ('TANQUE', 'Tanque de Almacenamiento', 'Tanque buffer o de almacenamiento de O2', '🛢️', 6),
+    ('ANALIZADOR', 'Analizador de O2', 'Analizador/sensor de pureza de oxígeno', '📊', 7),
+    ('OTRO', 'Otro', 'Otro tipo de equipo', '🔧', 99),
+]
+
+# Versión del esquema: cambia sola al editar la DDL o los tipos predefinidos
+_ESQUEMA_VERSION = hashlib.sha1(repr((_DDL_SCHEMA, _TIPOS_EQUIPO)).encode()).hexdigest()
+
+
+def _version_esquema(cursor) -> Optional[str]:
+    """Versión del esquema aplicada en la base (None si nunca se registró)"""
+    cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL AS existe")
+    if not cursor.fetchone()['existe']:
+        return None
+    cursor.execute("SELECT version FROM schema_version LIMIT 1")
+    row = cursor.fetchone()
+    return row['version'] if row else None
+
+
+def inicializar_db(admin_password: str = None):
+    """Crea todas las tablas necesarias (y el usuario admin si se pasa su contraseña)"""
+    with get_db() as conn:
+        cursor = conn.cursor()
         
-        # ============ ÍNDICES ============
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_historial_planta ON historial(planta_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_historial_timestamp ON historial(timestamp)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_historial_planta_ts ON historial(planta_id, timestamp)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_equipos_planta ON equipos(planta_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_equipos_tipo ON equipos(tipo_equipo_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_equipos_patrimonio ON equipos(numero_patrimonio)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_plantas_patrimonio ON plantas(numero_patrimonio)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_usuarios_telegram ON usuarios(telegram_id)")
+        # Un proceso a la vez: los demás esperan a que termine antes de servir
+        # requests y, con el esquema ya registrado, no repiten la DDL
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_DDL_LOCK_ID,))
+        
+        # La DDL completa solo corre si el esquema registrado es de otra versión
+        if _version_esquema(cursor) != _ESQUEMA_VERSION:
+            # Tablas e índices en un solo round-trip
+            cursor.execute(_DDL_SCHEMA)
+            
+            # Insertar tipos de equipo predefinidos
+            execute_values(cursor, """
+                INSERT INTO tipos_equipo (codigo, nombre, descripcion, icono, orden_display)
+                VALUES %s
+                ON CONFLICT (codigo) DO NOTHING
+            """, _TIPOS_EQUIPO)
+            
+            cursor.execute("""
+                DELETE FROM schema_version;
+                INSERT INTO schema_version (version) VALUES (%s);
+            """, (_ESQUEMA_VERSION,))
+            logger.info(f"Esquema actualizado a la versión {_ESQUEMA_VERSION[:12]}")
+        
+        _crear_particiones_historial(cursor)
+        
+        if admin_password is not None:
+            _crear_admin_por_defecto(cursor, admin_password)
         
         logger.info("Base de datos PostgreSQL inicializada correctamente")
 
 
+def _crear_admin_por_defecto(cursor, password: str):
+    """Crea el usuario admin si no existe (dentro de la transacción de inicializar_db)"""
+    cursor.execute("SELECT 1 FROM usuarios WHERE username = 'admin'")
+    if cursor.fetchone():
+        return
+    
+    cursor.execute("""
+        INSERT INTO usuarios (username, password_hash, rol, nombre_completo)
+        VALUES ('admin', %s, 'admin', 'Administrador')
+        ON CONFLICT (username) DO NOTHING
+    """, (_hash_password(password),))
+    if cursor.rowcount:
+        logger.info("Usuario admin creado")
+        logger.warning("¡CAMBIA LA CONTRASEÑA DEL ADMIN!")
+
+
+def _mes_siguiente(mes: date) -> date:
+    """Primer día del mes siguiente"""
+    return (mes.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _crear_particiones_historial(cursor, desde: date = None):
+    """Crea la partición de historial del mes y las HIST_MESES_ADELANTE siguientes"""
+    # Instalaciones anteriores conservan historial sin particionar
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = 'historial'::regclass")
+    if cursor.fetchone()['relkind'] != 'p':
+        return
+    
+    cursor.execute("CREATE TABLE IF NOT EXISTS historial_default PARTITION OF historial DEFAULT")
+    
+    mes = (desde or date.today()).replace(day=1)
+    for _ in range(HIST_MESES_ADELANTE + 1):
+        siguiente = _mes_siguiente(mes)
+        _crear_particion_mes(cursor, mes, siguiente)
+        mes = siguiente
+
+
+def _crear_particion_mes(cursor, mes: date, siguiente: date):
+    """Crea la partición [mes, siguiente) moviendo antes las filas que hayan caído en DEFAULT"""
+    nombre = f"historial_{mes:%Y_%m}"
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL AS existe", (nombre,))
+    if cursor.fetchone()['existe']:
+        return
+    
+    tabla = sql.Identifier(nombre)
+    rango = sql.SQL("FOR VALUES FROM ({}) TO ({})").format(
+        sql.Literal(mes.isoformat()), sql.Literal(siguiente.isoformat())
+    )
+    
+    cursor.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM historial_default WHERE timestamp >= %s AND timestamp < %s
+        ) AS hay
+    """, (mes, siguiente))
+    if not cursor.fetchone()['hay']:
+        cursor.execute(sql.SQL("CREATE TABLE {} PARTITION OF historial {}").format(tabla, rango))
+        return
+    
+    # Con filas del mes en DEFAULT el PARTITION OF fallaría: se mueven a la
+    # tabla nueva y recién entonces se adjunta
+    cursor.execute(sql.SQL("CREATE TABLE {} (LIKE historial INCLUDING DEFAULTS)").format(tabla))
+    cursor.execute(sql.SQL("""
+        WITH movidas AS (
+            DELETE FROM historial_default WHERE timestamp >= %s AND timestamp < %s
+            RETURNING *
+        )
+        INSERT INTO {} SELECT * FROM movidas
+    """).format(tabla), (mes, siguiente))
+    logger.warning(f"{cursor.rowcount} filas de historial_default movidas a {nombre}")
+    cursor.execute(sql.SQL("ALTER TABLE historial ATTACH PARTITION {} {}").format(tabla, rango))
+
+
 # ================================================================================
 # FUNCIONES DE USUARIOS
 # ================================================================================
 
+_USUARIO_CAMPOS = frozenset(['email', 'nombre_completo', 'rol', 'telegram_id', 'activo'])
+
+
+def _sql_update_preparado(tabla: str, columnas: tuple) -> str:
+    """UPDATE de todas las columnas editables: $2k-1 indica si la columna viene y $2k su valor"""
+    sets = ", ".join(
+        f"{c} = CASE WHEN ${2 * i + 1}::boolean THEN ${2 * i + 2} ELSE {c} END"
+        for i, c in enumerate(columnas)
+    )
+    return f"UPDATE {tabla} SET {sets}, updated_at = CURRENT_TIMESTAMP WHERE id = ${2 * len(columnas) + 1}"
+
+
+def _params_update(columnas: tuple, datos: Dict, registro_id) -> list:
+    """Parámetros (presente, valor) por columna para un UPDATE de _sql_update_preparado"""
+    params = []
+    for c in columnas:
+        params.append(c in datos)
+        params.append(datos.get(c))
+    params.append(registro_id)
+    return params
+
+
+@lru_cache(maxsize=256)
+def _build_update_sql(tabla: str, columnas: tuple) -> str:
+    """Arma el UPDATE de un subconjunto de columnas (cacheado por combinación)"""
+    sets = ", ".join(f"{c} = %s" for c in columnas)
+    return f"UPDATE {tabla} SET {sets}, updated_at = CURRENT_TIMESTAMP WHERE id = %s"
+
+
+def _clave_usuario(user_id: int) -> str:
+    return f"admin:usuario:{cache.CACHE_VERSION}:{int(user_id)}"
+
+
+def _invalidar_usuario(user_id: int):
+    """Descarta un usuario de las cachés de autenticación"""
+    cache.delete([_clave_usuario(user_id)])
+    with _user_lock:
+        # El índice por Telegram es pequeño; se limpia completo
+        _telegram_cache.clear()
+
+
+def _invalidar_logins():
+    """Olvida los logins cacheados (cambio de contraseña, rol o estado)"""
+    with _user_lock:
+        _login_cache.clear()
+
+
+def _hash_password(password: str) -> str:
+    """Hash para guardar en usuarios.password_hash"""
+    if _argon2 is not None:
+        return _argon2.hash(password)
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+
+
+def _verificar_password(password_hash: str, password: str) -> Tuple[bool, bool]:
+    """(es_correcta, conviene_rehashear) para un hash argon2id o Werkzeug"""
+    if password_hash.startswith("$argon2"):
+        if _argon2 is None:
+            logger.error("Hash argon2 en la BD pero argon2-cffi no está instalado")
+            return False, False
+        try:
+            _argon2.verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False, False
+        return True, _argon2.check_needs_rehash(password_hash)
+    
+    if not check_password_hash(password_hash, password):
+        return False, False
+    return True, _argon2 is not None
+
+
 def crear_usuario(username: str, password: str, rol: str = 'lector', 
                   email: str = None, nombre_completo: str = None,
                   telegram_id: int = None) -> Optional[int]:
@@ -295,7 +750,7 @@ def crear_usuario(username: str, password: str, rol: str = 'lector',
     try:
         with get_db() as conn:
             cursor = conn.cursor()
-            password_hash = generate_password_hash(password)
+            password_hash = _hash_password(password)
             cursor.execute("""
                 INSERT INTO usuarios (username, password_hash, rol, email, nombre_completo, telegram_id)
                 VALUES (%s, %s, %s, %s, %s, %s)
@@ -312,120 +767,213 @@ def verificar_usuario(username: str, password: str) -> Optional[Dict]:
     """Verifica credenciales y retorna datos del usuario"""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, username, password_hash, rol, nombre_completo, email, telegram_id, activo
-            FROM usuarios WHERE username = %s
-        """, (username,))
+        _ejecutar_preparado(cursor, "get_usuario_login", (username,))
         user = cursor.fetchone()
         
-        if user and user['activo'] and check_password_hash(user['password_hash'], password):
-            # Actualizar último acceso
+        if not (user and user['activo']):
+            return None
+        
+        # La clave incluye el hash guardado: un cambio de contraseña (en este
+        # u otro proceso) no encuentra entradas viejas
+        clave = None
+        if LOGIN_CACHE_TTL > 0:
+            clave = hashlib.sha256(
+                f"{username}\0{password}\0{user['password_hash']}".encode()
+            ).digest()
+            with _user_lock:
+                cacheado = clave in _login_cache
+        if clave is not None and cacheado:
+            # Credenciales ya verificadas: se evita recalcular el hash
+            correcta, rehashear = True, False
+        else:
+            correcta, rehashear = _verificar_password(user['password_hash'], password)
+        if not correcta:
+            return None
+        
+        # Actualizar último acceso (y migrar el hash si quedó viejo)
+        if rehashear:
+            cursor.execute("""
+                UPDATE usuarios SET ultimo_acceso = CURRENT_TIMESTAMP, password_hash = %s
+                WHERE id = %s
+            """, (_hash_password(password), user['id']))
+        else:
             cursor.execute("""
                 UPDATE usuarios SET ultimo_acceso = CURRENT_TIMESTAMP WHERE id = %s
             """, (user['id'],))
-            
-            return {
-                'id': user['id'],
-                'username': user['username'],
-                'rol': user['rol'],
-                'nombre_completo': user['nombre_completo'],
-                'email': user['email'],
-                'telegram_id': user['telegram_id']
-            }
-        return None
+    
+    _invalidar_usuario(user['id'])
+    if clave is not None and not rehashear:
+        with _user_lock:
+            _login_cache[clave] = True
+    return {
+        'id': user['id'],
+        'username': user['username'],
+        'rol': user['rol'],
+        'nombre_completo': user['nombre_completo'],
+        'email': user['email'],
+        'telegram_id': user['telegram_id']
+    }
 
 
 def obtener_usuario_por_id(user_id: int) -> Optional[Dict]:
-    """Obtiene usuario por ID"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, username, rol, nombre_completo, email, telegram_id, activo,
-                   ultimo_acceso, created_at
-            FROM usuarios WHERE id = %s
-        """, (user_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+    """Obtiene usuario por ID (cacheado USER_CACHE_TTL segundos)"""
+    def cargar():
+        with get_db_ro() as conn:
+            cursor = conn.cursor()
+            _ejecutar_preparado(cursor, "get_usuario_por_id", (int(user_id),))
+            return cursor.fetchone()
+    
+    user = cache.get_or_set(_clave_usuario(user_id), USER_CACHE_TTL, cargar)
+    return dict(user) if user else None
 
 
 def obtener_usuario_por_telegram(telegram_id: int) -> Optional[Dict]:
-    """Obtiene usuario por Telegram ID"""
-    with get_db() as conn:
+    """Obtiene usuario por Telegram ID (cacheado 60s)"""
+    with _user_lock:
+        cached = _telegram_cache.get(telegram_id)
+    if cached is not None:
+        return dict(cached)
+    
+    with get_db_ro() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT id, username, rol, nombre_completo, telegram_id, activo
             FROM usuarios WHERE telegram_id = %s AND activo = TRUE
         """, (telegram_id,))
         row = cursor.fetchone()
-        return dict(row) if row else None
+    
+    if not row:
+        return None
+    with _user_lock:
+        _telegram_cache[telegram_id] = row
+    return dict(row)
 
 
 def listar_usuarios() -> List[Dict]:
     """Lista todos los usuarios"""
-    with get_db() as conn:
+    with get_db_ro() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT id, username, rol, nombre_completo, email, telegram_id, 
                    activo, ultimo_acceso, created_at
             FROM usuarios ORDER BY created_at DESC
         """)
-        return [dict(row) for row in cursor.fetchall()]
+        return cursor.fetchall()
+
+
+def listar_usuarios_notificables() -> List[Dict]:
+    """Usuarios activos admin/operador con Telegram vinculado (destinatarios de alertas)"""
+    with get_db_ro() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT username, telegram_id FROM usuarios
+            WHERE activo = TRUE AND rol IN ('admin', 'operador') AND telegram_id IS NOT NULL
+        """)
+        return cursor.fetchall()
 
 
 def actualizar_usuario(user_id: int, datos: Dict) -> bool:
     """Actualiza datos de usuario"""
-    campos_permitidos = ['email', 'nombre_completo', 'rol', 'telegram_id', 'activo']
-    campos = {k: v for k, v in datos.items() if k in campos_permitidos}
+    columnas = tuple(sorted(k for k in datos if k in _USUARIO_CAMPOS))
     
-    if not campos:
+    if not columnas:
         return False
     
     with get_db() as conn:
         cursor = conn.cursor()
-        sets = ", ".join([f"{k} = %s" for k in campos.keys()])
-        values = list(campos.values()) + [user_id]
-        cursor.execute(f"""
-            UPDATE usuarios SET {sets}, updated_at = CURRENT_TIMESTAMP
-            WHERE id = %s
-        """, values)
-        return cursor.rowcount > 0
+        values = [datos[c] for c in columnas] + [user_id]
+        cursor.execute(_build_update_sql('usuarios', columnas), values)
+        actualizado = cursor.rowcount > 0
+    
+    _invalidar_usuario(user_id)
+    _invalidar_logins()
+    return actualizado
 
 
 def cambiar_password(user_id: int, nuevo_password: str) -> bool:
     """Cambia la contraseña de un usuario"""
     with get_db() as conn:
         cursor = conn.cursor()
-        password_hash = generate_password_hash(nuevo_password)
+        password_hash = _hash_password(nuevo_password)
         cursor.execute("""
             UPDATE usuarios SET password_hash = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = %s
         """, (password_hash, user_id))
-        return cursor.rowcount > 0
+        actualizado = cursor.rowcount > 0
+    
+    _invalidar_usuario(user_id)
+    _invalidar_logins()
+    return actualizado
 
 
 # ================================================================================
 # FUNCIONES DE PLANTAS
 # ================================================================================
 
+_PLANTA_CAMPOS = frozenset([
+    'nombre', 'codigo_interno', 'ubicacion', 'direccion', 'ciudad', 'departamento',
+    'numero_patrimonio', 'responsable', 'telefono_contacto', 'email_contacto',
+    'tipo_instalacion', 'capacidad_nominal_nm3h', 'fecha_instalacion',
+    'fecha_ultimo_mantenimiento', 'proximo_mantenimiento', 'estado', 'notas'
+])
+_PLANTA_COLUMNAS = tuple(sorted(_PLANTA_CAMPOS))
+_SENTENCIAS["update_planta"] = _sql_update_preparado('plantas', _PLANTA_COLUMNAS)
+
+
+def _clave_plantas(incluir_inactivas: bool) -> str:
+    return f"admin:plantas:{cache.CACHE_VERSION}:{bool(incluir_inactivas)}"
+
+
+# Claves exactas de los listados de plantas (obtener_plantas, /api/plantas y /scada)
+_CLAVES_LISTADOS_PLANTAS = [
+    _clave_plantas(False), _clave_plantas(True),
+    f"admin:plantas:json:{cache.CACHE_VERSION}:false",
+    f"admin:plantas:json:{cache.CACHE_VERSION}:true",
+    f"admin:plantas:scada:{cache.CACHE_VERSION}",
+]
+
+
 def obtener_plantas(incluir_inactivas: bool = False) -> Dict[str, Dict]:
-    """Obtiene todas las plantas"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        if incluir_inactivas:
-            cursor.execute("SELECT * FROM plantas ORDER BY nombre")
-        else:
-            cursor.execute("SELECT * FROM plantas WHERE activa = TRUE ORDER BY nombre")
-        rows = cursor.fetchall()
-        return {row["id"]: dict(row) for row in rows}
+    """Obtiene todas las plantas (cacheado PLANTAS_TTL segundos)"""
+    def cargar():
+        with get_db_ro() as conn:
+            cursor = conn.cursor()
+            if incluir_inactivas:
+                cursor.execute("SELECT * FROM plantas ORDER BY nombre")
+            else:
+                cursor.execute("SELECT * FROM plantas WHERE activa = TRUE ORDER BY nombre")
+            rows = cursor.fetchall()
+            return {row["id"]: row for row in rows}
+    
+    return cache.get_or_set(_clave_plantas(incluir_inactivas), PLANTAS_TTL, cargar)
 
 
 def obtener_planta(planta_id: str) -> Optional[Dict]:
-    """Obtiene una planta por ID"""
-    with get_db() as conn:
+    """Obtiene una planta por ID (cacheado 2s)"""
+    with _planta_lock:
+        cached = _planta_cache.get(planta_id)
+    if cached is not None:
+        return dict(cached)
+    
+    with get_db_ro() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM plantas WHERE id = %s", (planta_id,))
+        _ejecutar_preparado(cursor, "get_planta", (planta_id,))
         row = cursor.fetchone()
-        return dict(row) if row else None
+    
+    if not row:
+        return None
+    with _planta_lock:
+        _planta_cache[planta_id] = row
+    return dict(row)
+
+
+def _invalidar_planta(*planta_ids: str, listados: bool = True):
+    """Descarta plantas (y los listados de plantas) de la caché tras escribirlas"""
+    with _planta_lock:
+        for planta_id in planta_ids:
+            _planta_cache.pop(planta_id, None)
+    if listados:
+        cache.delete(_CLAVES_LISTADOS_PLANTAS)
 
 
 def crear_planta(planta_id: str, nombre: str, datos: Dict = None) -> bool:
@@ -464,111 +1012,344 @@ def crear_planta(planta_id: str, nombre: str, datos: Dict = None) -> bool:
                 INSERT INTO config_alertas (planta_id) VALUES (%s)
                 ON CONFLICT (planta_id) DO NOTHING
             """, (planta_id,))
-            
-            return True
     except psycopg2.IntegrityError as e:
         logger.error(f"Error creando planta: {e}")
         return False
+    
+    _invalidar_planta(planta_id)
+    return True
 
 
 def actualizar_planta(planta_id: str, datos: Dict) -> bool:
     """Actualiza datos de una planta (datos administrativos)"""
-    campos_permitidos = [
-        'nombre', 'codigo_interno', 'ubicacion', 'direccion', 'ciudad', 'departamento',
-        'numero_patrimonio', 'responsable', 'telefono_contacto', 'email_contacto',
-        'tipo_instalacion', 'capacidad_nominal_nm3h', 'fecha_instalacion',
-        'fecha_ultimo_mantenimiento', 'proximo_mantenimiento', 'estado', 'notas'
+    if _PLANTA_CAMPOS.isdisjoint(datos):
+        return False
+    
+    # Mismo statement preparado para cualquier subconjunto de columnas
+    with get_db() as conn:
+        cursor = conn.cursor()
+        _ejecutar_preparado(cursor, "update_planta", _params_update(_PLANTA_COLUMNAS, datos, planta_id))
+        actualizado = cursor.rowcount > 0
+    
+    _invalidar_planta(planta_id)
+    return actualizado
+
+
+# Campos de una muestra, en el orden de upsert_monitoreo ($4..$11; $12 es el timestamp) y de COPY
+_CAMPOS_MONITOREO = operator.itemgetter(
+    'presion_bar', 'temperatura_c', 'pureza_pct', 'flujo_nm3h',
+    'horas_operacion', 'modo', 'alarma', 'mensaje_alarma'
+)
+_DEFAULTS_MONITOREO = {
+    'presion_bar': 0, 'temperatura_c': 0, 'pureza_pct': 0, 'flujo_nm3h': 0,
+    'horas_operacion': None, 'modo': 'Desconocido', 'alarma': False, 'mensaje_alarma': ''
+}
+# En historial los campos ausentes se guardan como 0 / '' (no se conserva el valor previo)
+_DEFAULTS_HISTORIAL = {**_DEFAULTS_MONITOREO, 'horas_operacion': 0, 'modo': ''}
+
+
+_BOOL_TEXTO = {"true": True, "t": True, "1": True, "yes": True, "on": True,
+               "false": False, "f": False, "0": False, "no": False, "off": False}
+
+
+def _texto(valor, campo: str, largo: int = None) -> str:
+    texto = str(valor)
+    if largo is not None and len(texto) > largo:
+        raise ValueError(f"{campo}: máximo {largo} caracteres")
+    return texto
+
+
+def validar_muestra(datos: Dict) -> Dict:
+    """Copia de una lectura con los campos convertidos al tipo de su columna (ValueError si no se puede)"""
+    muestra = dict(datos)
+    if not muestra.get("planta_id"):
+        raise ValueError("se requiere planta_id")
+    muestra["planta_id"] = _texto(muestra["planta_id"], "planta_id", 50)
+    if muestra.get("nombre") is not None:
+        muestra["nombre"] = _texto(muestra["nombre"], "nombre", 100)
+    
+    for campo in ('presion_bar', 'temperatura_c', 'pureza_pct', 'flujo_nm3h', 'horas_operacion'):
+        valor = muestra.get(campo)
+        if valor is None:
+            continue
+        try:
+            numero = float(valor)
+        except (TypeError, ValueError):
+            raise ValueError(f"{campo}: se espera un número")
+        if not math.isfinite(numero):
+            raise ValueError(f"{campo}: se espera un número finito")
+        if campo == 'horas_operacion':
+            # Columna INTEGER: medio punto se aleja del cero, como al convertir en PostgreSQL
+            numero = int(math.copysign(math.floor(abs(numero) + 0.5), numero))
+        muestra[campo] = numero
+    
+    if muestra.get("modo") is not None:
+        muestra["modo"] = _texto(muestra["modo"], "modo", 50)
+    if muestra.get("mensaje_alarma") is not None:
+        muestra["mensaje_alarma"] = _texto(muestra["mensaje_alarma"], "mensaje_alarma")
+    
+    alarma = muestra.get("alarma")
+    if alarma is not None and not isinstance(alarma, bool):
+        alarma = _BOOL_TEXTO.get(str(alarma).strip().lower())
+        if alarma is None:
+            raise ValueError("alarma: se espera un booleano")
+        muestra["alarma"] = alarma
+    return muestra
+
+
+def actualizar_datos_monitoreo(planta_id: str, datos: Dict) -> bool:
+    """Actualiza datos de monitoreo en tiempo real (desde ESP32/PLC); devuelve la alarma anterior"""
+    # Tipos ya convertidos: lo que acepta el UPSERT también lo acepta el COPY del historial
+    datos = validar_muestra({**datos, "planta_id": planta_id})
+    valores = _CAMPOS_MONITOREO({**_DEFAULTS_MONITOREO, **datos})
+    # Reloj de la app (como las ventanas de estadísticas), no el de la sesión de PostgreSQL
+    timestamp = datetime.now()
+    
+    with get_db() as conn:
+        cursor = conn.cursor()
+        
+        # Actualiza el estado o crea una planta básica si no existe (UPSERT)
+        _ejecutar_preparado(
+            cursor, "upsert_monitoreo",
+            (planta_id, datos.get("nombre"), f"Planta {planta_id}") + valores + (timestamp,)
+        )
+        row = cursor.fetchone()
+    
+    # Los listados expiran solos (PLANTAS_TTL): la ingesta no toca la caché compartida
+    _invalidar_planta(planta_id, listados=False)
+    
+    # El historial se escribe en lote desde el writer en segundo plano
+    _encolar_historial((planta_id, timestamp) + _CAMPOS_MONITOREO({**_DEFAULTS_HISTORIAL, **datos}))
+    return row['alarma_anterior']
+
+
+_UPSERT_MONITOREO_BULK = """
+    WITH v (id, nombre, presion_bar, temperatura_c, pureza_pct, flujo_nm3h,
+            horas_operacion, modo, alarma, mensaje_alarma, ts) AS (VALUES %s),
+    upd AS (
+        UPDATE plantas p SET
+            nombre = COALESCE(v.nombre, p.nombre),
+            presion_bar = v.presion_bar,
+            temperatura_c = v.temperatura_c,
+            pureza_pct = v.pureza_pct,
+            flujo_nm3h = v.flujo_nm3h,
+            horas_operacion = COALESCE(v.horas_operacion, p.horas_operacion),
+            modo = v.modo,
+            alarma = v.alarma,
+            mensaje_alarma = v.mensaje_alarma,
+            ultima_actualizacion = v.ts
+        FROM v WHERE p.id = v.id
+        RETURNING p.id
+    ),
+    ins AS (
+        INSERT INTO plantas (id, nombre, presion_bar, temperatura_c, pureza_pct,
+                             flujo_nm3h, horas_operacion, modo, alarma,
+                             mensaje_alarma, ultima_actualizacion)
+        SELECT id, COALESCE(nombre, 'Planta ' || id), presion_bar, temperatura_c, pureza_pct,
+               flujo_nm3h, COALESCE(horas_operacion, 0), modo, alarma, mensaje_alarma, ts
+        FROM v WHERE id NOT IN (SELECT id FROM upd)
+        ON CONFLICT (id) DO NOTHING
+    )
+    SELECT count(*) AS actualizadas FROM upd
+"""
+_UPSERT_MONITOREO_BULK_FILA = (
+    "(%s::varchar, %s::varchar, %s::real, %s::real, %s::real, %s::real, "
+    "%s::integer, %s::varchar, %s::boolean, %s::text, %s::timestamp)"
+)
+
+
+def actualizar_datos_monitoreo_bulk(lista: List[Dict]) -> int:
+    """Varias lecturas de monitoreo en un solo UPSERT; devuelve cuántas se procesaron"""
+    lista = [validar_muestra(datos) for datos in lista]
+    muestras = [
+        (datos["planta_id"], datos.get("nombre"),
+         _CAMPOS_MONITOREO({**_DEFAULTS_MONITOREO, **datos}))
+        for datos in lista
     ]
-    campos = {k: v for k, v in datos.items() if k in campos_permitidos}
+    if not muestras:
+        return 0
+    timestamp = datetime.now()
     
-    if not campos:
-        return False
+    # El estado actual queda con la última lectura de cada planta
+    ultimas = {}
+    for planta_id, nombre, valores in muestras:
+        anterior = ultimas.get(planta_id)
+        if nombre is None and anterior is not None:
+            nombre = anterior[1]
+        ultimas[planta_id] = (planta_id, nombre) + valores + (timestamp,)
     
     with get_db() as conn:
         cursor = conn.cursor()
-        sets = ", ".join([f"{k} = %s" for k in campos.keys()])
-        values = list(campos.values()) + [planta_id]
-        cursor.execute(f"""
-            UPDATE plantas SET {sets}, updated_at = CURRENT_TIMESTAMP
-            WHERE id = %s
-        """, values)
-        return cursor.rowcount > 0
+        execute_values(cursor, _UPSERT_MONITOREO_BULK, list(ultimas.values()),
+                       template=_UPSERT_MONITOREO_BULK_FILA, page_size=len(ultimas))
+    
+    _invalidar_planta(*ultimas, listados=False)
+    
+    for datos in lista:
+        _encolar_historial((datos["planta_id"], timestamp)
+                           + _CAMPOS_MONITOREO({**_DEFAULTS_HISTORIAL, **datos}))
+    return len(muestras)
+
+
+def _encolar_historial(fila: tuple):
+    """Agrega una muestra a la cola del writer de historial"""
+    _iniciar_writer_historial()
+    _hist_queue.put(fila)
+
+
+def _iniciar_writer_historial():
+    """Arranca el thread writer de historial (uno por proceso)"""
+    global _hist_writer
+    if _hist_writer is not None and _hist_writer.is_alive():
+        return
+    
+    with _hist_writer_lock:
+        if _hist_writer is None or not _hist_writer.is_alive():
+            _hist_writer = threading.Thread(
+                target=_loop_writer_historial, name="psa-historial", daemon=True
+            )
+            _hist_writer.start()
+
+
+def _drenar_historial() -> Tuple[List[tuple], bool]:
+    """Bloquea hasta la primera muestra y junta hasta HIST_BATCH o HIST_FLUSH_MS
+
+    Devuelve (filas, fin); fin indica que llegó _HIST_FIN y el writer debe terminar.
+    """
+    fila = _hist_queue.get()
+    if fila is _HIST_FIN:
+        return [], True
+    
+    filas = [fila]
+    limite = time.monotonic() + HIST_FLUSH_MS / 1000
+    while len(filas) < HIST_BATCH:
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            break
+        try:
+            fila = _hist_queue.get(timeout=restante)
+        except queue.Empty:
+            break
+        if fila is _HIST_FIN:
+            return filas, True
+        filas.append(fila)
+    return filas, False
+
+
+_COPY_HISTORIAL = """
+    COPY historial (planta_id, timestamp, presion_bar, temperatura_c, pureza_pct,
+                    flujo_nm3h, horas_operacion, modo, alarma, mensaje_alarma)
+    FROM STDIN
+"""
+
+
+def _campo_copy(valor) -> str:
+    """Serializa un valor al formato texto de COPY"""
+    if valor is None:
+        return "\\N"
+    return (str(valor).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def _asegurar_particion_historial(timestamp):
+    """Crea las particiones al cambiar de mes (una vez por mes y proceso)"""
+    global _hist_mes_listo
+    mes = date(timestamp.year, timestamp.month, 1)
+    if mes == _hist_mes_listo:
+        return
+    
+    try:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_DDL_LOCK_ID,))
+            _crear_particiones_historial(cursor, mes)
+        _hist_mes_listo = mes
+    except Exception as e:
+        logger.error(f"Error creando particiones de historial para {mes:%Y-%m}: {e}")
 
 
-def actualizar_datos_monitoreo(planta_id: str, datos: Dict):
-    """Actualiza datos de monitoreo en tiempo real (desde ESP32/PLC)"""
+def _copy_historial(filas: List[tuple]):
+    """Un COPY con las filas dadas (una transacción)"""
+    buf = io.StringIO()
+    for fila in filas:
+        buf.write("\t".join(map(_campo_copy, fila)))
+        buf.write("\n")
+    buf.seek(0)
+    
     with get_db() as conn:
         cursor = conn.cursor()
-        timestamp = datetime.now()
-        
-        # Verificar si existe la planta
-        cursor.execute("SELECT id FROM plantas WHERE id = %s", (planta_id,))
-        existe = cursor.fetchone()
-        
-        if existe:
-            cursor.execute("""
-                UPDATE plantas SET
-                    nombre = COALESCE(%s, nombre),
-                    presion_bar = %s,
-                    temperatura_c = %s,
-                    pureza_pct = %s,
-                    flujo_nm3h = %s,
-                    horas_operacion = COALESCE(%s, horas_operacion),
-                    modo = %s,
-                    alarma = %s,
-                    mensaje_alarma = %s,
-                    ultima_actualizacion = %s
-                WHERE id = %s
-            """, (
-                datos.get("nombre"),
-                datos.get("presion_bar", 0),
-                datos.get("temperatura_c", 0),
-                datos.get("pureza_pct", 0),
-                datos.get("flujo_nm3h", 0),
-                datos.get("horas_operacion"),
-                datos.get("modo", "Desconocido"),
-                datos.get("alarma", False),
-                datos.get("mensaje_alarma", ""),
-                timestamp,
-                planta_id
-            ))
-        else:
-            # Crear planta básica si no existe
-            cursor.execute("""
-                INSERT INTO plantas (id, nombre, presion_bar, temperatura_c, pureza_pct,
-                                    flujo_nm3h, horas_operacion, modo, alarma, 
-                                    mensaje_alarma, ultima_actualizacion)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                planta_id,
-                datos.get("nombre", f"Planta {planta_id}"),
-                datos.get("presion_bar", 0),
-                datos.get("temperatura_c", 0),
-                datos.get("pureza_pct", 0),
-                datos.get("flujo_nm3h", 0),
-                datos.get("horas_operacion", 0),
-                datos.get("modo", "Desconocido"),
-                datos.get("alarma", False),
-                datos.get("mensaje_alarma", ""),
-                timestamp
-            ))
-        
-        # Guardar en historial
-        cursor.execute("""
-            INSERT INTO historial (planta_id, timestamp, presion_bar, temperatura_c,
-                                  pureza_pct, flujo_nm3h, modo, alarma, mensaje_alarma, horas_operacion)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            planta_id, timestamp,
-            datos.get("presion_bar", 0),
-            datos.get("temperatura_c", 0),
-            datos.get("pureza_pct", 0),
-            datos.get("flujo_nm3h", 0),
-            datos.get("modo", ""),
-            datos.get("alarma", False),
-            datos.get("mensaje_alarma", ""),
-            datos.get("horas_operacion", 0)
-        ))
+        # Telemetría append-only: perder ~100ms ante un crash es aceptable
+        cursor.execute("SET LOCAL synchronous_commit = OFF")
+        cursor.copy_expert(_COPY_HISTORIAL, buf)
+
+
+def _escribir_historial(filas: List[tuple]):
+    """Carga un lote de muestras en historial con un único COPY
+
+    Si PostgreSQL rechaza el lote, se reintenta fila por fila y solo se
+    pierden las filas que fallan.
+    """
+    _asegurar_particion_historial(filas[-1][1])
+    
+    try:
+        _copy_historial(filas)
+        escritas = filas
+    except psycopg2.OperationalError:
+        # Conexión/servidor: reintentar fila por fila no ayudaría
+        raise
+    except psycopg2.Error as e:
+        logger.error(f"COPY de {len(filas)} muestras falló ({e}); se reintenta fila por fila")
+        escritas = []
+        for fila in filas:
+            try:
+                _copy_historial([fila])
+                escritas.append(fila)
+            except psycopg2.OperationalError:
+                raise
+            except psycopg2.Error as e:
+                logger.error(f"Muestra de historial descartada {fila[:2]}: {e}")
+    
+    stats_cache.registrar_muestras((fila[0], fila[1]) for fila in escritas)
+
+
+def _loop_writer_historial():
+    """Loop del writer: drena la cola y escribe por lotes hasta recibir _HIST_FIN"""
+    fin = False
+    while not fin:
+        filas, fin = _drenar_historial()
+        if not filas:
+            continue
+        try:
+            _escribir_historial(filas)
+        except Exception as e:
+            logger.error(f"Error escribiendo {len(filas)} muestras de historial: {e}")
+
+
+@atexit.register
+def _vaciar_historial():
+    """Al cerrar el proceso, el writer escribe su lote y lo que quede en la cola"""
+    writer = _hist_writer
+    if writer is not None and writer.is_alive():
+        _hist_queue.put(_HIST_FIN)
+        writer.join(timeout=10)
+        if writer.is_alive():
+            logger.error("El writer de historial no terminó a tiempo al salir")
+            return
+    
+    filas = []
+    while True:
+        try:
+            fila = _hist_queue.get_nowait()
+        except queue.Empty:
+            break
+        if fila is not _HIST_FIN:
+            filas.append(fila)
+    if not filas:
+        return
+    try:
+        _escribir_historial(filas)
+    except Exception as e:
+        logger.error(f"Error vaciando {len(filas)} muestras de historial al salir: {e}")
 
 
 def eliminar_planta(planta_id: str, soft_delete: bool = True) -> bool:
@@ -582,28 +1363,33 @@ def eliminar_planta(planta_id: str, soft_delete: bool = True) -> bool:
             """, (planta_id,))
         else:
             cursor.execute("DELETE FROM plantas WHERE id = %s", (planta_id,))
-        return cursor.rowcount > 0
+        eliminado = cursor.rowcount > 0
+    
+    _invalidar_planta(planta_id)
+    return eliminado
 
 
 # ================================================================================
 # FUNCIONES DE TIPOS DE EQUIPO
 # ================================================================================
 
+@cache.cached("tipos_equipo", ttl=300)
 def obtener_tipos_equipo() -> List[Dict]:
-    """Obtiene todos los tipos de equipo"""
-    with get_db() as conn:
+    """Obtiene todos los tipos de equipo (cacheado 5 min)"""
+    with get_db_ro() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM tipos_equipo ORDER BY orden_display")
-        return [dict(row) for row in cursor.fetchall()]
+        return cursor.fetchall()
 
 
 # ================================================================================
 # FUNCIONES DE SERIES DE EQUIPO
 # ================================================================================
 
+@cache.cached("series_equipo", ttl=300)
 def obtener_series_equipo(tipo_equipo_id: int = None) -> List[Dict]:
-    """Obtiene series de equipo, opcionalmente filtradas por tipo"""
-    with get_db() as conn:
+    """Obtiene series de equipo, opcionalmente filtradas por tipo (cacheado 5 min)"""
+    with get_db_ro() as conn:
         cursor = conn.cursor()
         if tipo_equipo_id:
             cursor.execute("""
@@ -621,7 +1407,7 @@ def obtener_series_equipo(tipo_equipo_id: int = None) -> List[Dict]:
                 WHERE se.activo = TRUE
                 ORDER BY te.orden_display, se.fabricante, se.modelo
             """)
-        return [dict(row) for row in cursor.fetchall()]
+        return cursor.fetchall()
 
 
 def crear_serie_equipo(datos: Dict) -> Optional[int]:
@@ -644,54 +1430,76 @@ def crear_serie_equipo(datos: Dict) -> Optional[int]:
                 datos.get('imagen_url')
             ))
             result = cursor.fetchone()
-            return result['id'] if result else None
     except psycopg2.IntegrityError:
         return None
+    
+    cache.invalidate("admin:series_equipo:*")
+    return result['id'] if result else None
 
 
 # ================================================================================
 # FUNCIONES DE EQUIPOS
 # ================================================================================
 
+_EQUIPO_CAMPOS = frozenset([
+    'planta_id', 'serie_equipo_id', 'nombre', 'numero_serie', 'numero_patrimonio',
+    'tag', 'marca', 'modelo', 'año_fabricacion', 'ubicacion_interna', 'posicion',
+    'estado', 'criticidad', 'fecha_instalacion', 'fecha_ultimo_mantenimiento',
+    'proximo_mantenimiento', 'horas_operacion', 'horas_proximo_servicio', 'notas'
+])
+_EQUIPO_COLUMNAS = tuple(sorted(_EQUIPO_CAMPOS))
+_SENTENCIAS["update_equipo"] = _sql_update_preparado('equipos', _EQUIPO_COLUMNAS)
+
+
+def _sql_equipos(incluir_inactivos: bool, por_planta: bool, por_tipo: bool) -> str:
+    """SELECT de equipos para una combinación de filtros"""
+    where = []
+    if not incluir_inactivos:
+        where.append("e.activo = TRUE")
+    if por_planta:
+        where.append("e.planta_id = %s")
+    if por_tipo:
+        where.append("e.tipo_equipo_id = %s")
+    
+    # Con un solo tipo, orden_display es constante: el índice ya da el orden
+    orden = "e.posicion, e.nombre" if por_tipo else "te.orden_display, e.posicion, e.nombre"
+    
+    return f"""
+        SELECT e.*, 
+               te.nombre as tipo_nombre, te.codigo as tipo_codigo, te.icono as tipo_icono,
+               se.fabricante as serie_fabricante, se.modelo as serie_modelo,
+               p.nombre as planta_nombre
+        FROM equipos e
+        JOIN tipos_equipo te ON e.tipo_equipo_id = te.id
+        LEFT JOIN series_equipo se ON e.serie_equipo_id = se.id
+        LEFT JOIN plantas p ON e.planta_id = p.id
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {orden}
+    """
+
+
+# Las 8 variantes de filtro, armadas una sola vez
+_EQUIPOS_SQL = {
+    (inc, pl, ti): _sql_equipos(inc, pl, ti)
+    for inc in (False, True) for pl in (False, True) for ti in (False, True)
+}
+
+
 def obtener_equipos(planta_id: str = None, tipo_equipo_id: int = None, 
                     incluir_inactivos: bool = False) -> List[Dict]:
     """Obtiene equipos con filtros opcionales"""
-    with get_db() as conn:
+    query = _EQUIPOS_SQL[(bool(incluir_inactivos), bool(planta_id), bool(tipo_equipo_id))]
+    params = [v for v in (planta_id, tipo_equipo_id) if v]
+    
+    with get_db_ro() as conn:
         cursor = conn.cursor()
-        
-        query = """
-            SELECT e.*, 
-                   te.nombre as tipo_nombre, te.codigo as tipo_codigo, te.icono as tipo_icono,
-                   se.fabricante as serie_fabricante, se.modelo as serie_modelo,
-                   p.nombre as planta_nombre
-            FROM equipos e
-            JOIN tipos_equipo te ON e.tipo_equipo_id = te.id
-            LEFT JOIN series_equipo se ON e.serie_equipo_id = se.id
-            LEFT JOIN plantas p ON e.planta_id = p.id
-            WHERE 1=1
-        """
-        params = []
-        
-        if not incluir_inactivos:
-            query += " AND e.activo = TRUE"
-        
-        if planta_id:
-            query += " AND e.planta_id = %s"
-            params.append(planta_id)
-        
-        if tipo_equipo_id:
-            query += " AND e.tipo_equipo_id = %s"
-            params.append(tipo_equipo_id)
-        
-        query += " ORDER BY te.orden_display, e.posicion, e.nombre"
-        
         cursor.execute(query, params)
-        return [dict(row) for row in cursor.fetchall()]
+        return cursor.fetchall()
 
 
 def obtener_equipo(equipo_id: int) -> Optional[Dict]:
     """Obtiene un equipo por ID"""
-    with get_db() as conn:
+    with get_db_ro() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT e.*, 
@@ -704,8 +1512,36 @@ def obtener_equipo(equipo_id: int) -> Optional[Dict]:
             LEFT JOIN plantas p ON e.planta_id = p.id
             WHERE e.id = %s
         """, (equipo_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        return cursor.fetchone()
+
+
+# Columnas del alta de equipos con su valor por defecto (_REQUERIDO = sin default)
+_REQUERIDO = object()
+_EQUIPO_INSERT_COLS = (
+    ('planta_id', _REQUERIDO), ('tipo_equipo_id', _REQUERIDO), ('serie_equipo_id', None),
+    ('nombre', _REQUERIDO), ('numero_serie', None), ('numero_patrimonio', None),
+    ('tag', None), ('marca', None), ('modelo', None), ('año_fabricacion', None),
+    ('ubicacion_interna', None), ('posicion', 1), ('estado', 'operativo'),
+    ('criticidad', 'media'), ('fecha_instalacion', None), ('horas_operacion', 0),
+    ('horas_proximo_servicio', None), ('notas', None)
+)
+
+# Alta del equipo y su evento de instalación en un solo statement
+_EQUIPO_INSERT_SQL = f"""
+    WITH ins AS (
+        INSERT INTO equipos ({", ".join(c for c, _ in _EQUIPO_INSERT_COLS)})
+        VALUES ({", ".join(["%s"] * len(_EQUIPO_INSERT_COLS))})
+        RETURNING id, planta_id
+    )
+    INSERT INTO historial_equipos (equipo_id, tipo_evento, descripcion, planta_destino_id)
+    SELECT id, 'instalacion', 'Equipo registrado en el sistema', planta_id FROM ins
+    RETURNING equipo_id
+"""
+
+
+def _params_equipo(datos: Dict) -> tuple:
+    """Valores del INSERT de equipos en el orden de _EQUIPO_INSERT_COLS"""
+    return tuple(datos[c] if d is _REQUERIDO else datos.get(c, d) for c, d in _EQUIPO_INSERT_COLS)
 
 
 def crear_equipo(datos: Dict) -> Optional[int]:
@@ -713,71 +1549,46 @@ def crear_equipo(datos: Dict) -> Optional[int]:
     try:
         with get_db() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO equipos (
-                    planta_id, tipo_equipo_id, serie_equipo_id, nombre, numero_serie,
-                    numero_patrimonio, tag, marca, modelo, año_fabricacion,
-                    ubicacion_interna, posicion, estado, criticidad,
-                    fecha_instalacion, horas_operacion, horas_proximo_servicio, notas
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                ) RETURNING id
-            """, (
-                datos['planta_id'],
-                datos['tipo_equipo_id'],
-                datos.get('serie_equipo_id'),
-                datos['nombre'],
-                datos.get('numero_serie'),
-                datos.get('numero_patrimonio'),
-                datos.get('tag'),
-                datos.get('marca'),
-                datos.get('modelo'),
-                datos.get('año_fabricacion'),
-                datos.get('ubicacion_interna'),
-                datos.get('posicion', 1),
-                datos.get('estado', 'operativo'),
-                datos.get('criticidad', 'media'),
-                datos.get('fecha_instalacion'),
-                datos.get('horas_operacion', 0),
-                datos.get('horas_proximo_servicio'),
-                datos.get('notas')
-            ))
+            cursor.execute(_EQUIPO_INSERT_SQL, _params_equipo(datos))
             result = cursor.fetchone()
-            
-            if result:
-                # Registrar en historial
-                cursor.execute("""
-                    INSERT INTO historial_equipos (equipo_id, tipo_evento, descripcion, planta_destino_id)
-                    VALUES (%s, 'instalacion', 'Equipo registrado en el sistema', %s)
-                """, (result['id'], datos['planta_id']))
-            
-            return result['id'] if result else None
+            return result['equipo_id'] if result else None
     except psycopg2.IntegrityError as e:
         logger.error(f"Error creando equipo: {e}")
         return None
 
 
+def crear_equipos_bulk(lista: List[Dict]) -> Optional[List[int]]:
+    """Crea varios equipos (y sus eventos de instalación) en lotes con execute_values"""
+    if not lista:
+        return []
+    try:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            filas = execute_values(cursor, f"""
+                WITH ins AS (
+                    INSERT INTO equipos ({", ".join(c for c, _ in _EQUIPO_INSERT_COLS)})
+                    VALUES %s
+                    RETURNING id, planta_id
+                )
+                INSERT INTO historial_equipos (equipo_id, tipo_evento, descripcion, planta_destino_id)
+                SELECT id, 'instalacion', 'Equipo registrado en el sistema', planta_id FROM ins
+                RETURNING equipo_id
+            """, [_params_equipo(d) for d in lista], page_size=500, fetch=True)
+            return [f['equipo_id'] for f in filas]
+    except psycopg2.IntegrityError as e:
+        logger.error(f"Error creando {len(lista)} equipos: {e}")
+        return None
+
+
 def actualizar_equipo(equipo_id: int, datos: Dict) -> bool:
     """Actualiza datos de un equipo"""
-    campos_permitidos = [
-        'planta_id', 'serie_equipo_id', 'nombre', 'numero_serie', 'numero_patrimonio',
-        'tag', 'marca', 'modelo', 'año_fabricacion', 'ubicacion_interna', 'posicion',
-        'estado', 'criticidad', 'fecha_instalacion', 'fecha_ultimo_mantenimiento',
-        'proximo_mantenimiento', 'horas_operacion', 'horas_proximo_servicio', 'notas'
-    ]
-    campos = {k: v for k, v in datos.items() if k in campos_permitidos}
-    
-    if not campos:
+    if _EQUIPO_CAMPOS.isdisjoint(datos):
         return False
     
+    # Mismo statement preparado para cualquier subconjunto de columnas
     with get_db() as conn:
         cursor = conn.cursor()
-        sets = ", ".join([f"{k} = %s" for k in campos.keys()])
-        values = list(campos.values()) + [equipo_id]
-        cursor.execute(f"""
-            UPDATE equipos SET {sets}, updated_at = CURRENT_TIMESTAMP
-            WHERE id = %s
-        """, values)
+        _ejecutar_preparado(cursor, "update_equipo", _params_update(_EQUIPO_COLUMNAS, datos, equipo_id))
         return cursor.rowcount > 0
 
 
@@ -798,25 +1609,30 @@ def eliminar_equipo(equipo_id: int, soft_delete: bool = True) -> bool:
 
 def buscar_por_patrimonio(numero: str) -> Dict:
     """Busca plantas y equipos por número de patrimonio"""
-    with get_db() as conn:
+    patron = f"%{numero}%"
+    with get_db_ro() as conn:
         cursor = conn.cursor()
         
-        # Buscar en plantas
+        # Plantas y equipos en un solo round-trip
         cursor.execute("""
-            SELECT 'planta' as tipo, id, nombre, numero_patrimonio, ubicacion
+            SELECT 'planta' AS tipo, id::text AS id, nombre, numero_patrimonio, ubicacion,
+                   NULL::text AS planta_nombre, NULL::text AS planta_id
             FROM plantas WHERE numero_patrimonio ILIKE %s AND activa = TRUE
-        """, (f"%{numero}%",))
-        plantas = [dict(row) for row in cursor.fetchall()]
-        
-        # Buscar en equipos
-        cursor.execute("""
-            SELECT 'equipo' as tipo, e.id, e.nombre, e.numero_patrimonio, 
-                   p.nombre as planta_nombre, e.planta_id
+            UNION ALL
+            SELECT 'equipo', e.id::text, e.nombre, e.numero_patrimonio, NULL,
+                   p.nombre, e.planta_id
             FROM equipos e
             LEFT JOIN plantas p ON e.planta_id = p.id
             WHERE e.numero_patrimonio ILIKE %s AND e.activo = TRUE
-        """, (f"%{numero}%",))
-        equipos = [dict(row) for row in cursor.fetchall()]
+        """, (patron, patron))
+        
+        plantas, equipos = [], []
+        for row in cursor:
+            if row['tipo'] == 'planta':
+                plantas.append(row)
+            else:
+                row['id'] = int(row['id'])
+                equipos.append(row)
         
         return {'plantas': plantas, 'equipos': equipos}
 
@@ -825,121 +1641,316 @@ def buscar_por_patrimonio(numero: str) -> Dict:
 # FUNCIONES DE HISTORIAL Y ESTADÍSTICAS
 # ================================================================================
 
-def obtener_historial(planta_id: str, desde: str = None, hasta: str = None, 
-                      limite: int = None) -> List[Dict]:
-    """Obtiene historial de monitoreo"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        
-        query = """
-            SELECT planta_id, timestamp, presion_bar, temperatura_c,
-                   pureza_pct, flujo_nm3h, modo, alarma, mensaje_alarma, horas_operacion
-            FROM historial WHERE planta_id = %s
-        """
+def _filtro_historial(planta_id, desde: str = None, hasta: str = None):
+    """Arma el WHERE de historial para una planta (o lista de plantas) y un rango de fechas"""
+    if isinstance(planta_id, (list, tuple)):
+        where = "planta_id = ANY(%s)"
+        params = [list(planta_id)]
+    else:
+        where = "planta_id = %s"
         params = [planta_id]
-        
-        if desde:
-            if len(desde) == 10:
-                desde = desde + "T00:00:00"
-            query += " AND timestamp >= %s"
-            params.append(desde)
-        
-        if hasta:
-            if len(hasta) == 10:
-                hasta = hasta + "T23:59:59"
-            query += " AND timestamp <= %s"
-            params.append(hasta)
-        
-        query += " ORDER BY timestamp ASC"
-        
-        if limite:
-            query += f" LIMIT {limite}"
-        
-        cursor.execute(query, params)
-        
+    
+    if desde:
+        if len(desde) == 10:
+            desde = desde + "T00:00:00"
+        where += " AND timestamp >= %s"
+        params.append(desde)
+    
+    if hasta:
+        if len(hasta) == 10:
+            hasta = hasta + "T23:59:59"
+        where += " AND timestamp <= %s"
+        params.append(hasta)
+    
+    return where, params
+
+
+def obtener_historial(planta_id: str, desde: str = None, hasta: str = None, 
+                      limite: int = None, raw: bool = False) -> List[Dict]:
+    """Obtiene historial de monitoreo (raw=True deja timestamp como datetime)"""
+    where, params = _filtro_historial(planta_id, desde, hasta)
+    return _leer_historial(where, params, "timestamp ASC", limite, raw)
+
+
+# Columnas de historial que se exponen (API y CSV), en orden
+COLUMNAS_HISTORIAL = (
+    'planta_id', 'timestamp', 'presion_bar', 'temperatura_c', 'pureza_pct',
+    'flujo_nm3h', 'modo', 'alarma', 'mensaje_alarma', 'horas_operacion'
+)
+
+
+def iterar_historial(planta_id, desde: str = None, hasta: str = None) -> Iterator[List[tuple]]:
+    """Historial por lotes de tuplas (orden de COLUMNAS_HISTORIAL), para exportar en streaming
+    
+    Usa una conexión propia del pool y no la del request: el generador se
+    sigue consumiendo después del teardown.
+    """
+    multi = isinstance(planta_id, (list, tuple))
+    if multi and not planta_id:
+        return
+    where, params = _filtro_historial(planta_id, desde, hasta)
+    orden = "planta_id, timestamp ASC" if multi else "timestamp ASC"
+    
+    with _conexion_pool() as conn:
+        try:
+            yield from _lotes_historial(conn, where, params, orden, servidor=True, tuplas=True)
+        finally:
+            # Solo lectura: cierra la transacción del cursor con nombre
+            if not conn.closed:
+                conn.rollback()
+
+
+def _lotes_historial(conn, where: str, params: list, orden: str, limite: int = None,
+                     raw: bool = False, servidor: bool = False,
+                     tuplas: bool = False) -> Iterator[List]:
+    """Ejecuta la lectura de historial y la entrega por lotes (dicts o tuplas)"""
+    columnas = ", ".join(COLUMNAS_HISTORIAL)
+    if tuplas:
+        # Tuplas para csv.writer: el timestamp ya sale en ISO desde PostgreSQL
+        columnas = columnas.replace(
+            "timestamp", """to_char(timestamp, 'YYYY-MM-DD"T"HH24:MI:SS.US')""", 1
+        )
+    query = f"""
+        SELECT {columnas}
+        FROM historial WHERE {where}
+        ORDER BY {orden}
+    """
+    if limite:
+        query += " LIMIT %s"
+        params.append(int(limite))
+    
+    factory = psycopg2.extensions.cursor if tuplas else None
+    if servidor:
+        cursor = conn.cursor(name=f"hist_{uuid.uuid4().hex}", cursor_factory=factory)
+    else:
+        cursor = conn.cursor(cursor_factory=factory)
+    cursor.execute(query, params)
+    
+    for lote in iter(lambda: cursor.fetchmany(HIST_ITERSIZE), []):
+        if not raw and not tuplas:
+            for row in lote:
+                if row['timestamp']:
+                    row['timestamp'] = row['timestamp'].isoformat()
+        yield lote
+
+
+def _leer_historial(where: str, params: list, orden: str, limite: int = None,
+                    raw: bool = False) -> List[Dict]:
+    """Lee historial completo en memoria"""
+    # Rangos grandes: cursor del lado del servidor, memoria acotada a HIST_ITERSIZE filas
+    servidor = not limite or int(limite) > HIST_CURSOR_SERVIDOR_MIN
+    
+    with (get_db() if servidor else get_db_ro()) as conn:
         result = []
-        for row in cursor.fetchall():
-            r = dict(row)
-            if r.get('timestamp'):
-                r['timestamp'] = r['timestamp'].isoformat()
-            result.append(r)
-        
+        for lote in _lotes_historial(conn, where, params, orden, limite, raw, servidor):
+            result.extend(lote)
         return result
 
 
-def calcular_estadisticas(datos: List[Dict]) -> Dict:
-    """Calcula estadísticas de una lista de datos de monitoreo"""
-    if not datos:
-        return {}
-    
-    def safe_stats(values):
-        values = [v for v in values if v is not None]
-        if not values:
+def _stats_columna(valores: List) -> Dict:
+    """min/max/avg/std de una columna ignorando nulos"""
+    if np is not None:
+        arr = np.array([np.nan if v is None else v for v in valores], dtype=np.float64)
+        arr = arr[~np.isnan(arr)]
+        if not arr.size:
             return {"min": 0, "max": 0, "avg": 0, "std": 0, "count": 0}
         return {
-            "min": round(min(values), 2),
-            "max": round(max(values), 2),
-            "avg": round(mean(values), 2),
-            "std": round(stdev(values), 2) if len(values) > 1 else 0,
-            "count": len(values)
+            "min": round(float(arr.min()), 2),
+            "max": round(float(arr.max()), 2),
+            "avg": round(float(arr.mean()), 2),
+            "std": round(float(arr.std(ddof=1)), 2) if arr.size > 1 else 0,
+            "count": int(arr.size)
         }
     
-    pureza = [d.get("pureza_pct", 0) for d in datos]
-    flujo = [d.get("flujo_nm3h", 0) for d in datos]
-    presion = [d.get("presion_bar", 0) for d in datos]
-    temperatura = [d.get("temperatura_c", 0) for d in datos]
+    # Sin NumPy: una pasada de Welford en floats nativos (statistics usa Fraction)
+    n, media, m2 = 0, 0.0, 0.0
+    minimo, maximo = math.inf, -math.inf
+    for v in valores:
+        if v is None:
+            continue
+        n += 1
+        if v < minimo:
+            minimo = v
+        if v > maximo:
+            maximo = v
+        delta = v - media
+        media += delta / n
+        m2 += delta * (v - media)
     
-    alarmas = sum(1 for d in datos if d.get("alarma"))
+    if not n:
+        return {"min": 0, "max": 0, "avg": 0, "std": 0, "count": 0}
+    return {
+        "min": round(minimo, 2),
+        "max": round(maximo, 2),
+        "avg": round(media, 2),
+        "std": round(math.sqrt(m2 / (n - 1)), 2) if n > 1 else 0,
+        "count": n
+    }
+
+
+def calcular_estadisticas(datos: List[Dict]) -> Dict:
+    """Calcula estadísticas de una lista de datos de monitoreo"""
+    if not datos:
+        return {}
     
-    modos = {}
-    for d in datos:
-        modo = d.get("modo", "Desconocido")
-        modos[modo] = modos.get(modo, 0) + 1
+    registros = len(datos)
+    columnas = {m: [d.get(col, 0) for d in datos] for m, col in _METRICAS_HISTORIAL.items()}
     
-    tiempo_produccion = modos.get("Producción", 0)
-    disponibilidad = (tiempo_produccion / len(datos) * 100) if datos else 0
-    pureza_ok = sum(1 for p in pureza if p >= 93)
-    cumplimiento_pureza = (pureza_ok / len(pureza) * 100) if pureza else 0
+    # Conteos en C: Counter para modos, NumPy (si está) para alarmas
+    modos = dict(Counter(d.get("modo", "Desconocido") for d in datos))
+    if np is not None:
+        alarmas = int(np.count_nonzero(np.fromiter(
+            (bool(d.get("alarma")) for d in datos), dtype=bool, count=registros
+        )))
+    else:
+        alarmas = sum(1 for d in datos if d.get("alarma"))
     
-    return {
-        "periodo": {"registros": len(datos)},
-        "pureza": safe_stats(pureza),
-        "flujo": safe_stats(flujo),
-        "presion": safe_stats(presion),
-        "temperatura": safe_stats(temperatura),
+    pureza_ok = sum(1 for p in columnas["pureza"] if p is not None and p >= 93)
+    
+    resultado = {"periodo": {"registros": registros}}
+    resultado.update((m, _stats_columna(valores)) for m, valores in columnas.items())
+    resultado.update({
         "alarmas": {"total": alarmas},
         "modos": modos,
         "kpis": {
-            "disponibilidad": round(disponibilidad, 2),
-            "cumplimiento_pureza": round(cumplimiento_pureza, 2)
+            "disponibilidad": round(modos.get("Producción", 0) / registros * 100, 2),
+            "cumplimiento_pureza": round(pureza_ok / registros * 100, 2)
         }
+    })
+    return resultado
+
+
+# Métrica del resultado -> columna de historial
+_METRICAS_HISTORIAL = {
+    'pureza': 'pureza_pct',
+    'flujo': 'flujo_nm3h',
+    'presion': 'presion_bar',
+    'temperatura': 'temperatura_c',
+}
+
+# Agregados combinables por métrica: n, media, M2 (para std), min, max
+_AGREGADOS_HISTORIAL = ",\n".join(
+    f"count({col}) AS {m}_n, avg({col})::float8 AS {m}_media, "
+    f"(COALESCE(var_pop({col}), 0) * count({col}))::float8 AS {m}_m2, "
+    f"min({col}) AS {m}_min, max({col}) AS {m}_max"
+    for m, col in _METRICAS_HISTORIAL.items()
+)
+
+
+def _agregados_historial(where: str, params: list, por_hora: bool) -> Dict:
+    """Agregados de historial en PostgreSQL, por hora o uno solo (clave None)"""
+    grupo = "date_trunc('hour', timestamp)" if por_hora else "NULL::timestamp"
+    
+    with get_db_ro() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH h AS (SELECT * FROM historial WHERE {where}),
+            a AS (
+                SELECT {grupo} AS hora, count(*) AS registros,
+                       count(*) FILTER (WHERE alarma) AS alarmas,
+                       count(*) FILTER (WHERE pureza_pct >= 93) AS pureza_ok,
+                       {_AGREGADOS_HISTORIAL}
+                FROM h GROUP BY 1
+            ),
+            m AS (
+                SELECT {grupo} AS hora, COALESCE(modo, 'Desconocido') AS modo, count(*) AS n
+                FROM h GROUP BY 1, 2
+            )
+            SELECT a.*, (SELECT json_object_agg(m.modo, m.n) FROM m
+                         WHERE m.hora IS NOT DISTINCT FROM a.hora) AS modos
+            FROM a
+        """, params)
+        filas = cursor.fetchall()
+    
+    return {
+        row['hora']: {
+            "registros": row['registros'],
+            "alarmas": row['alarmas'],
+            "pureza_ok": row['pureza_ok'],
+            "modos": row['modos'] or {},
+            "metricas": {
+                m: (row[f'{m}_n'], row[f'{m}_media'], row[f'{m}_m2'],
+                    row[f'{m}_min'], row[f'{m}_max'])
+                for m in _METRICAS_HISTORIAL
+            },
+        }
+        for row in filas
     }
 
 
-def obtener_estadisticas_globales() -> Dict:
-    """Obtiene estadísticas globales de todas las plantas"""
-    plantas = obtener_plantas()
+def obtener_estadisticas_planta(planta_id: str, desde: str = None, hasta: str = None) -> Dict:
+    """Estadísticas de historial (mismo formato que calcular_estadisticas)
     
-    total = len(plantas)
-    operando = sum(1 for p in plantas.values() if p.get("modo") == "Producción")
-    mant = sum(1 for p in plantas.values() if p.get("modo") == "Mantenimiento")
-    alarma = sum(1 for p in plantas.values() if p.get("alarma"))
+    Las horas cerradas de la ventana salen de stats_cache; PostgreSQL solo
+    agrega los bordes parciales y las horas que aún no están cacheadas.
+    """
+    horas = stats_cache.horas_completas(desde, hasta)
+    if not horas:
+        where, params = _filtro_historial(planta_id, desde, hasta)
+        total = _agregados_historial(where, params, por_hora=False).get(None, stats_cache.vacio())
+        return stats_cache.a_estadisticas(total, _METRICAS_HISTORIAL)
     
-    if plantas:
-        pureza_prom = mean([p.get("pureza_pct", 0) or 0 for p in plantas.values()])
-        flujo_total = sum([p.get("flujo_nm3h", 0) or 0 for p in plantas.values()])
-    else:
-        pureza_prom = 0
-        flujo_total = 0
+    cacheadas = stats_cache.leer(planta_id, horas)
+    faltan = [h for h in horas if h not in cacheadas]
     
-    return {
-        "total_plantas": total,
-        "plantas_operando": operando,
-        "plantas_mantenimiento": mant,
-        "plantas_alarma": alarma,
-        "pureza_promedio": round(pureza_prom, 2),
-        "flujo_total": round(flujo_total, 2)
-    }
+    # Bordes parciales + rango de horas faltantes, en una sola consulta
+    where, params = _filtro_historial(planta_id, desde, hasta)
+    rangos = ["timestamp < %s", "timestamp >= %s"]
+    params += [horas[0], horas[-1] + stats_cache.HORA]
+    if faltan:
+        rangos.append("(timestamp >= %s AND timestamp < %s)")
+        params += [faltan[0], faltan[-1] + stats_cache.HORA]
+    por_hora = _agregados_historial(f"{where} AND ({' OR '.join(rangos)})", params, por_hora=True)
+    
+    nuevas = {h: por_hora.pop(h, stats_cache.vacio()) for h in faltan}
+    stats_cache.guardar(planta_id, nuevas)
+    
+    total = stats_cache.vacio()
+    for agregado in (*cacheadas.values(), *nuevas.values()):
+        total = stats_cache.combinar(total, agregado)
+    for hora, agregado in por_hora.items():
+        if hora not in cacheadas:
+            total = stats_cache.combinar(total, agregado)
+    return stats_cache.a_estadisticas(total, _METRICAS_HISTORIAL)
+
+
+def obtener_resumen_admin() -> Dict:
+    """Conteos del panel de administración en una sola consulta"""
+    with get_db_ro() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT p.total_plantas, p.plantas_activas, e.total_equipos, e.equipos_operativos
+            FROM (
+                SELECT count(*) AS total_plantas,
+                       count(*) FILTER (WHERE activa) AS plantas_activas
+                FROM plantas
+            ) p, (
+                SELECT count(*) AS total_equipos,
+                       count(*) FILTER (WHERE estado = 'operativo') AS equipos_operativos
+                FROM equipos
+            ) e
+        """)
+        return cursor.fetchone()
+
+
+def obtener_estadisticas_globales() -> Dict:
+    """Obtiene estadísticas globales de todas las plantas activas"""
+    with get_db_ro() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT count(*) AS total_plantas,
+                   count(*) FILTER (WHERE modo = 'Producción') AS plantas_operando,
+                   count(*) FILTER (WHERE modo = 'Mantenimiento') AS plantas_mantenimiento,
+                   count(*) FILTER (WHERE alarma) AS plantas_alarma,
+                   COALESCE(avg(COALESCE(pureza_pct, 0)), 0) AS pureza_promedio,
+                   COALESCE(sum(flujo_nm3h), 0) AS flujo_total
+            FROM plantas WHERE activa = TRUE
+        """)
+        stats = cursor.fetchone()
+    
+    stats['pureza_promedio'] = round(stats['pureza_promedio'], 2)
+    stats['flujo_total'] = round(stats['flujo_total'], 2)
+    return stats
 
 
 # ================================================================================
@@ -949,27 +1960,20 @@ def obtener_estadisticas_globales() -> Dict:
 def validar_patrimonio_unico(numero: str, excluir_planta: str = None, 
                               excluir_equipo: int = None) -> bool:
     """Valida que un número de patrimonio sea único"""
-    with get_db() as conn:
+    excluir_planta = excluir_planta or None
+    excluir_equipo = excluir_equipo or None
+    
+    with get_db_ro() as conn:
         cursor = conn.cursor()
-        
-        # Verificar en plantas
-        query = "SELECT id FROM plantas WHERE numero_patrimonio = %s AND activa = TRUE"
-        params = [numero]
-        if excluir_planta:
-            query += " AND id != %s"
-            params.append(excluir_planta)
-        cursor.execute(query, params)
-        if cursor.fetchone():
-            return False
-        
-        # Verificar en equipos
-        query = "SELECT id FROM equipos WHERE numero_patrimonio = %s AND activo = TRUE"
-        params = [numero]
-        if excluir_equipo:
-            query += " AND id != %s"
-            params.append(excluir_equipo)
-        cursor.execute(query, params)
-        if cursor.fetchone():
-            return False
-        
-        return True
+        cursor.execute("""
+            SELECT EXISTS(
+                SELECT 1 FROM plantas
+                WHERE numero_patrimonio = %(numero)s AND activa = TRUE
+                  AND (%(planta)s::text IS NULL OR id <> %(planta)s)
+                UNION ALL
+                SELECT 1 FROM equipos
+                WHERE numero_patrimonio = %(numero)s AND activo = TRUE
+                  AND (%(equipo)s::int IS NULL OR id <> %(equipo)s)
+            ) AS existe
+        """, {'numero': numero, 'planta': excluir_planta, 'equipo': excluir_equipo})
+        return not cursor.fetchone()['existe']
@@ -16,7 +16,9 @@ from app.database import (
     # Usuarios
     listar_usuarios, obtener_usuario_por_id, crear_usuario, actualizar_usuario, cambiar_password,
     # Validaciones
-    validar_patrimonio_unico
+    validar_patrimonio_unico,
+    # Estadísticas
+    obtener_resumen_admin
 )
 from app.routes.auth import login_required, admin_required, operador_required, get_current_user
 
@@ -32,19 +34,67 @@ admin_bp = Blueprint('admin', __name__)
 def index():
     """Panel de administración"""
     user = get_current_user()
-    plantas = obtener_plantas(incluir_inactivas=True)
-    equipos = obtener_equipos(incluir_inactivos=True)
-    
-    stats = {
-        'total_plantas': len(plantas),
-        'plantas_activas': sum(1 for p in plantas.values() if p.get('activa')),
-        'total_equipos': len(equipos),
-        'equipos_operativos': sum(1 for e in equipos if e.get('estado') == 'operativo')
-    }
+    stats = obtener_resumen_admin()
     
     return render_template('admin/index.html', user=user, stats=stats)
 
 
+# ================================================================================
+# FORMULARIOS
+# ================================================================================
+
+def _texto(v):
+    return (v or '').strip()
+
+
+def _texto_opt(v):
+    return (v or '').strip() or None
+
+
+def _entero_opt(v):
+    return int(v) if v else None
+
+
+def _valor_opt(v):
+    return v or None
+
+
+def _valor(v):
+    return v
+
+
+# Formulario de equipos: (campo, conversión, valor si no viene)
+_FORM_EQUIPO = (
+    ('planta_id', _valor, None),
+    ('tipo_equipo_id', int, None),
+    ('serie_equipo_id', _entero_opt, None),
+    ('nombre', _texto, ''),
+    ('numero_serie', _texto_opt, ''),
+    ('numero_patrimonio', _texto_opt, ''),
+    ('tag', _texto_opt, ''),
+    ('marca', _texto_opt, ''),
+    ('modelo', _texto_opt, ''),
+    ('año_fabricacion', _entero_opt, None),
+    ('ubicacion_interna', _texto_opt, ''),
+    ('posicion', int, 1),
+    ('estado', _valor, 'operativo'),
+    ('criticidad', _valor, 'media'),
+    ('fecha_instalacion', _valor_opt, None),
+    ('horas_operacion', int, 0),
+    ('horas_proximo_servicio', _entero_opt, None),
+    ('notas', _texto_opt, ''),
+)
+
+
+def _leer_form_equipo(form, con_tipo: bool = True) -> dict:
+    """Convierte el formulario de equipo en datos tipados en una sola pasada"""
+    return {
+        campo: conv(form.get(campo, default))
+        for campo, conv, default in _FORM_EQUIPO
+        if con_tipo or campo != 'tipo_equipo_id'
+    }
+
+
 # ================================================================================
 # CRUD PLANTAS
 # ================================================================================
@@ -198,34 +248,15 @@ def equipos_nuevo():
     planta_id = request.args.get('planta_id')
     
     if request.method == 'POST':
-        patrimonio = request.form.get('numero_patrimonio', '').strip()
+        datos = _leer_form_equipo(request.form)
+        
+        patrimonio = datos['numero_patrimonio']
         if patrimonio and not validar_patrimonio_unico(patrimonio):
             flash('El número de patrimonio ya está en uso', 'error')
             return render_template('admin/equipos/form.html', 
                                    user=user, equipo=request.form, 
                                    plantas=plantas, tipos=tipos, series=series)
         
-        datos = {
-            'planta_id': request.form.get('planta_id'),
-            'tipo_equipo_id': int(request.form.get('tipo_equipo_id')),
-            'serie_equipo_id': int(request.form.get('serie_equipo_id')) if request.form.get('serie_equipo_id') else None,
-            'nombre': request.form.get('nombre', '').strip(),
-            'numero_serie': request.form.get('numero_serie', '').strip() or None,
-            'numero_patrimonio': patrimonio or None,
-            'tag': request.form.get('tag', '').strip() or None,
-            'marca': request.form.get('marca', '').strip() or None,
-            'modelo': request.form.get('modelo', '').strip() or None,
-            'año_fabricacion': int(request.form.get('año_fabricacion')) if request.form.get('año_fabricacion') else None,
-            'ubicacion_interna': request.form.get('ubicacion_interna', '').strip() or None,
-            'posicion': int(request.form.get('posicion', 1)),
-            'estado': request.form.get('estado', 'operativo'),
-            'criticidad': request.form.get('criticidad', 'media'),
-            'fecha_instalacion': request.form.get('fecha_instalacion') or None,
-            'horas_operacion': int(request.form.get('horas_operacion', 0)),
-            'horas_proximo_servicio': int(request.form.get('horas_proximo_servicio')) if request.form.get('horas_proximo_servicio') else None,
-            'notas': request.form.get('notas', '').strip() or None
-        }
-        
         if not datos['planta_id'] or not datos['nombre']:
             flash('Planta y nombre son requeridos', 'error')
             return render_template('admin/equipos/form.html', 
@@ -264,33 +295,15 @@ def equipos_editar(equipo_id):
     series = obtener_series_equipo()
     
     if request.method == 'POST':
-        patrimonio = request.form.get('numero_patrimonio', '').strip()
+        datos = _leer_form_equipo(request.form, con_tipo=False)
+        
+        patrimonio = datos['numero_patrimonio']
         if patrimonio and not validar_patrimonio_unico(patrimonio, excluir_equipo=equipo_id):
             flash('El número de patrimonio ya está en uso', 'error')
             return render_template('admin/equipos/form.html', 
                                    user=user, equipo=equipo,
                                    plantas=plantas, tipos=tipos, series=series)
         
-        datos = {
-            'planta_id': request.form.get('planta_id'),
-            'serie_equipo_id': int(request.form.get('serie_equipo_id')) if request.form.get('serie_equipo_id') else None,
-            'nombre': request.form.get('nombre', '').strip(),
-            'numero_serie': request.form.get('numero_serie', '').strip() or None,
-            'numero_patrimonio': patrimonio or None,
-            'tag': request.form.get('tag', '').strip() or None,
-            'marca': request.form.get('marca', '').strip() or None,
-            'modelo': request.form.get('modelo', '').strip() or None,
-            'año_fabricacion': int(request.form.get('año_fabricacion')) if request.form.get('año_fabricacion') else None,
-            'ubicacion_interna': request.form.get('ubicacion_interna', '').strip() or None,
-            'posicion': int(request.form.get('posicion', 1)),
-            'estado': request.form.get('estado', 'operativo'),
-            'criticidad': request.form.get('criticidad', 'media'),
-            'fecha_instalacion': request.form.get('fecha_instalacion') or None,
-            'horas_operacion': int(request.form.get('horas_operacion', 0)),
-            'horas_proximo_servicio': int(request.form.get('horas_proximo_servicio')) if request.form.get('horas_proximo_servicio') else None,
-            'notas': request.form.get('notas', '').strip() or None
-        }
-        
         if actualizar_equipo(equipo_id, datos):
             flash('Equipo actualizado correctamente', 'success')
             return redirect(url_for('admin.equipos_lista'))
@@ -7,34 +7,69 @@ Endpoints para plantas, equipos, monitoreo, estadísticas
 
 import os
 import io
+import logging
+import hmac
+import hashlib
 import csv
+import itertools
 from datetime import datetime, timedelta
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, current_app
+from flask_jwt_extended import verify_jwt_in_request
 
 from app.database import (
     # Plantas
-    obtener_plantas, obtener_planta, crear_planta, actualizar_planta,
-    actualizar_datos_monitoreo, eliminar_planta,
+    obtener_plantas, obtener_planta, crear_planta, actualizar_planta, PLANTAS_TTL,
+    actualizar_datos_monitoreo, actualizar_datos_monitoreo_bulk, validar_muestra, eliminar_planta,
     # Equipos
     obtener_equipos, obtener_equipo, crear_equipo, actualizar_equipo, eliminar_equipo,
     obtener_tipos_equipo, obtener_series_equipo, crear_serie_equipo,
     # Estadísticas
-    obtener_historial, calcular_estadisticas, obtener_estadisticas_globales,
+    obtener_historial, iterar_historial, COLUMNAS_HISTORIAL,
+    obtener_estadisticas_planta, obtener_estadisticas_globales,
     # Validaciones
     validar_patrimonio_unico, buscar_por_patrimonio
 )
 from app.routes.auth import login_required, admin_required, operador_required
+from app.services import cache
+
+logger = logging.getLogger(__name__)
 
 api_bp = Blueprint('api', __name__)
 
 # API Key para dispositivos IoT (ESP32, PLC, etc.)
 API_KEY = os.environ.get("API_KEY", "clave_secreta_123")
+_API_KEY_BYTES = API_KEY.encode()
 
 
 def verificar_api_key():
-    """Verifica API key en header o query param"""
-    api_key = request.headers.get("X-API-Key") or request.args.get("api_key")
-    return api_key == API_KEY
+    """Verifica API key en header o query param (comparación en tiempo constante)"""
+    api_key = request.headers.get("X-API-Key")
+    if api_key is None:
+        api_key = request.args.get("api_key")
+        if api_key is None:
+            return False
+    return hmac.compare_digest(api_key.encode(), _API_KEY_BYTES)
+
+
+def _revalidable(resp: Response, etag: str = None) -> Response:
+    """ETag + revalidación: si el cliente ya tiene esta versión responde 304 sin cuerpo"""
+    if etag:
+        resp.set_etag(etag)
+    else:
+        resp.add_etag()
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+
+def _json_cacheado(nombre: str, clave: str, ttl: int, loader):
+    """Respuesta JSON ya serializada desde la caché (se invalida junto con admin:<nombre>:*)"""
+    def serializar():
+        blob = current_app.json.dumps(loader()).encode()
+        return hashlib.md5(blob).hexdigest(), blob
+    
+    key = f"admin:{nombre}:json:{cache.CACHE_VERSION}:{clave}"
+    etag, blob = cache.get_or_set(key, ttl, serializar)
+    return _revalidable(Response(blob, mimetype="application/json"), etag)
 
 
 # ================================================================================
@@ -54,12 +89,8 @@ def recibir_datos():
         
         planta_id = datos["planta_id"]
         
-        # Obtener estado anterior para detectar nuevas alarmas
-        planta_anterior = obtener_planta(planta_id)
-        alarma_anterior = planta_anterior.get("alarma", False) if planta_anterior else False
-        
-        # Actualizar datos
-        actualizar_datos_monitoreo(planta_id, datos)
+        # Actualizar datos (devuelve la alarma previa para detectar nuevas alarmas)
+        alarma_anterior = actualizar_datos_monitoreo(planta_id, datos)
         
         # TODO: Enviar alerta si hay nueva alarma (integrar con bot)
         nueva_alarma = datos.get("alarma", False) and not alarma_anterior
@@ -70,6 +101,8 @@ def recibir_datos():
             "nueva_alarma": nueva_alarma
         }), 200
         
+    except ValueError as e:
+        return jsonify({"error": f"Datos inválidos - {e}"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -85,16 +118,28 @@ def recibir_datos_batch():
         if not isinstance(datos_list, list):
             return jsonify({"error": "Se espera una lista de datos"}), 400
         
-        procesados = 0
+        validos = []
         errores = []
+        for i, datos in enumerate(datos_list):
+            if not isinstance(datos, dict):
+                errores.append(f"#{i}: se espera un objeto")
+                continue
+            try:
+                validos.append(validar_muestra(datos))
+            except ValueError as e:
+                errores.append(f"#{i} ({datos.get('planta_id')}): {e}")
         
-        for datos in datos_list:
-            if "planta_id" in datos:
+        try:
+            procesados = actualizar_datos_monitoreo_bulk(validos)
+        except Exception:
+            # Si el lote falla igual, una por una para no perder las lecturas buenas
+            procesados = 0
+            for datos in validos:
                 try:
                     actualizar_datos_monitoreo(datos["planta_id"], datos)
                     procesados += 1
                 except Exception as e:
-                    errores.append(f"{datos.get('planta_id')}: {str(e)}")
+                    errores.append(f"{datos['planta_id']}: {e}")
         
         return jsonify({
             "status": "ok",
@@ -116,24 +161,14 @@ def listar_plantas():
     # Soportar tanto API key como JWT
     if not verificar_api_key():
         try:
-            from flask_jwt_extended import verify_jwt_in_request
             verify_jwt_in_request()
         except:
             return jsonify({"error": "No autorizado"}), 401
     
     incluir_inactivas = request.args.get('incluir_inactivas', 'false').lower() == 'true'
-    plantas = obtener_plantas(incluir_inactivas)
-    
-    # Convertir timestamps a string
-    for p in plantas.values():
-        for key in ['ultima_actualizacion', 'created_at', 'updated_at']:
-            if p.get(key) and hasattr(p[key], 'isoformat'):
-                p[key] = p[key].isoformat()
-        for key in ['fecha_instalacion', 'fecha_ultimo_mantenimiento', 'proximo_mantenimiento']:
-            if p.get(key) and hasattr(p[key], 'isoformat'):
-                p[key] = p[key].isoformat()
     
-    return jsonify(plantas), 200
+    return _json_cacheado("plantas", str(incluir_inactivas).lower(), PLANTAS_TTL,
+                          lambda: obtener_plantas(incluir_inactivas))
 
 
 @api_bp.route('/plantas/<planta_id>', methods=['GET'])
@@ -144,11 +179,6 @@ def obtener_planta_api(planta_id):
     if not planta:
         return jsonify({"error": "Planta no encontrada"}), 404
     
-    # Convertir timestamps
-    for key in ['ultima_actualizacion', 'created_at', 'updated_at']:
-        if planta.get(key) and hasattr(planta[key], 'isoformat'):
-            planta[key] = planta[key].isoformat()
-    
     return jsonify(planta), 200
 
 
@@ -219,8 +249,7 @@ def eliminar_planta_api(planta_id):
 @login_required
 def listar_tipos_equipo():
     """Lista todos los tipos de equipo"""
-    tipos = obtener_tipos_equipo()
-    return jsonify(tipos), 200
+    return _json_cacheado("tipos_equipo", "todos", 300, obtener_tipos_equipo)
 
 
 # ================================================================================
@@ -232,8 +261,8 @@ def listar_tipos_equipo():
 def listar_series_equipo():
     """Lista series de equipo"""
     tipo_id = request.args.get('tipo_equipo_id', type=int)
-    series = obtener_series_equipo(tipo_id)
-    return jsonify(series), 200
+    return _json_cacheado("series_equipo", str(tipo_id), 300,
+                          lambda: obtener_series_equipo(tipo_id))
 
 
 @api_bp.route('/series-equipo', methods=['POST'])
@@ -275,14 +304,7 @@ def listar_equipos():
     
     equipos = obtener_equipos(planta_id, tipo_id, incluir_inactivos)
     
-    # Convertir fechas
-    for e in equipos:
-        for key in ['fecha_instalacion', 'fecha_ultimo_mantenimiento', 'proximo_mantenimiento', 
-                    'fecha_baja', 'created_at', 'updated_at']:
-            if e.get(key) and hasattr(e[key], 'isoformat'):
-                e[key] = e[key].isoformat()
-    
-    return jsonify(equipos), 200
+    return _revalidable(jsonify(equipos))
 
 
 @api_bp.route('/equipos/<int:equipo_id>', methods=['GET'])
@@ -369,7 +391,6 @@ def historial_api():
     """Obtiene historial de monitoreo"""
     if not verificar_api_key():
         try:
-            from flask_jwt_extended import verify_jwt_in_request
             verify_jwt_in_request()
         except:
             return jsonify({"error": "No autorizado"}), 401
@@ -398,7 +419,6 @@ def estadisticas_api():
     """Obtiene estadísticas"""
     if not verificar_api_key():
         try:
-            from flask_jwt_extended import verify_jwt_in_request
             verify_jwt_in_request()
         except:
             return jsonify({"error": "No autorizado"}), 401
@@ -408,8 +428,7 @@ def estadisticas_api():
     if planta_id:
         desde = request.args.get('desde')
         hasta = request.args.get('hasta')
-        datos = obtener_historial(planta_id, desde, hasta)
-        stats = calcular_estadisticas(datos)
+        stats = obtener_estadisticas_planta(planta_id, desde, hasta)
     else:
         stats = obtener_estadisticas_globales()
     
@@ -421,7 +440,6 @@ def exportar_csv():
     """Exporta datos a CSV"""
     if not verificar_api_key():
         try:
-            from flask_jwt_extended import verify_jwt_in_request
             verify_jwt_in_request()
         except:
             return jsonify({"error": "No autorizado"}), 401
@@ -431,26 +449,31 @@ def exportar_csv():
     hasta = request.args.get('hasta')
     
     if planta_id and planta_id.lower() != 'all':
-        datos = obtener_historial(planta_id, desde, hasta)
+        lotes = iterar_historial(planta_id, desde, hasta)
     else:
-        # Exportar todas las plantas
-        plantas = obtener_plantas()
-        datos = []
-        for pid in plantas:
-            datos.extend(obtener_historial(pid, desde, hasta))
+        # Exportar todas las plantas en una sola consulta
+        lotes = iterar_historial(list(obtener_plantas()), desde, hasta)
     
-    if not datos:
+    primero = next(lotes, None)
+    if not primero:
+        lotes.close()
         return Response("Sin datos", mimetype="text/plain")
     
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=datos[0].keys())
-    writer.writeheader()
-    writer.writerows(datos)
+    def generar():
+        # Se escribe lote a lote: memoria acotada a HIST_ITERSIZE filas
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(COLUMNAS_HISTORIAL)
+        for lote in itertools.chain([primero], lotes):
+            writer.writerows(lote)
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
     
     filename = f"historial_{planta_id or 'todas'}_{datetime.now().strftime('%Y%m%d')}.csv"
     
     return Response(
-        output.getvalue(),
+        generar(),
         mimetype="text/csv",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
@@ -500,3 +523,30 @@ def health():
         "timestamp": datetime.now().isoformat(),
         "database": "postgresql"
     }), 200
+
+
+# ================================================================================
+# TELEGRAM (modo webhook)
+# ================================================================================
+
+@api_bp.route('/telegram/webhook', methods=['POST'])
+def telegram_webhook():
+    """Recibe updates de Telegram cuando el bot corre con TELEGRAM_WEBHOOK_URL"""
+    from app.telegram_bot import TELEGRAM_WEBHOOK_SECRET, encolar_update
+    
+    secreto = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not TELEGRAM_WEBHOOK_SECRET or not hmac.compare_digest(
+            secreto.encode(), TELEGRAM_WEBHOOK_SECRET.encode()):
+        return jsonify({"error": "No autorizado"}), 401
+    
+    datos = request.get_json(silent=True)
+    if not datos:
+        return jsonify({"error": "Update vacío"}), 400
+    
+    if not encolar_update(datos):
+        # Un 5xx haría que Telegram reintente sin fin: el bot solo corre con
+        # main.py (gunicorn no lo arranca), así que se descarta el update
+        logger.error("Update de Telegram recibido pero el bot no corre en este proceso")
+        return jsonify({"ok": False, "error": "Bot no disponible"}), 200
+    
+    return jsonify({"ok": True}), 200
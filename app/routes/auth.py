@@ -4,10 +4,10 @@ Rutas de Autenticación
 ================================================================================
 """
 
-from flask import Blueprint, request, jsonify, render_template, redirect, url_for, make_response
+from flask import Blueprint, request, jsonify, render_template, redirect, url_for, make_response, g
 from flask_jwt_extended import (
     create_access_token, create_refresh_token, jwt_required, 
-    get_jwt_identity, set_access_cookies, unset_jwt_cookies,
+    get_jwt, get_jwt_identity, set_access_cookies, unset_jwt_cookies,
     verify_jwt_in_request
 )
 from functools import wraps
@@ -30,6 +30,7 @@ def login_required(func):
     def wrapper(*args, **kwargs):
         try:
             verify_jwt_in_request()
+            _exigir_usuario_vigente()
             return func(*args, **kwargs)
         except Exception:
             if request.is_json or request.path.startswith('/api/'):
@@ -44,9 +45,8 @@ def admin_required(func):
     def wrapper(*args, **kwargs):
         try:
             verify_jwt_in_request()
-            user_id = get_jwt_identity()
-            user = obtener_usuario_por_id(user_id)
-            if not user or user.get('rol') != 'admin':
+            _exigir_usuario_vigente()
+            if _rol_request() != 'admin':
                 if request.is_json:
                     return jsonify({"error": "Solo administradores"}), 403
                 return render_template('error.html', 
@@ -66,9 +66,8 @@ def operador_required(func):
     def wrapper(*args, **kwargs):
         try:
             verify_jwt_in_request()
-            user_id = get_jwt_identity()
-            user = obtener_usuario_por_id(user_id)
-            if not user or user.get('rol') not in ['admin', 'operador']:
+            _exigir_usuario_vigente()
+            if _rol_request() not in ('admin', 'operador'):
                 if request.is_json:
                     return jsonify({"error": "Permisos insuficientes"}), 403
                 return render_template('error.html', 
@@ -81,13 +80,44 @@ def operador_required(func):
     return wrapper
 
 
+def _usuario_request(user_id):
+    """Carga el usuario una sola vez por request (memo en flask.g)"""
+    if '_usuario_actual' not in g:
+        g._usuario_actual = obtener_usuario_por_id(user_id) if user_id else None
+    return g._usuario_actual
+
+
+def _usuario_vigente():
+    """Usuario del token verificado si sigue existiendo y activo (leído de la caché)"""
+    user = _usuario_request(get_jwt_identity())
+    if not user or not user.get('activo'):
+        return None
+    return user
+
+
+def _exigir_usuario_vigente():
+    """Rechaza tokens válidos de usuarios eliminados o desactivados"""
+    if _usuario_vigente() is None:
+        raise PermissionError("Usuario inexistente o inactivo")
+
+
+def _rol_request():
+    """Rol actual del usuario: el claim 'rol' del token puede haber quedado viejo
+
+    obtener_usuario_por_id está cacheado e invalidado en actualizar_usuario,
+    así que un cambio de rol rige desde el siguiente request sin consultar la BD.
+    """
+    user = _usuario_vigente()
+    return user.get('rol') if user else None
+
+
 def get_current_user():
     """Obtiene el usuario actual si está autenticado"""
+    if '_usuario_actual' in g:
+        return g._usuario_actual
     try:
         verify_jwt_in_request(optional=True)
-        user_id = get_jwt_identity()
-        if user_id:
-            return obtener_usuario_por_id(user_id)
+        return _usuario_request(get_jwt_identity())
     except Exception:
         pass
     return None
@@ -4,21 +4,32 @@ Rutas del Dashboard
 ================================================================================
 """
 
-import json
 import os
+import re
+import hashlib
 from datetime import datetime, timedelta
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, current_app
+from markupsafe import escape
 
 from app.database import (
     obtener_plantas, obtener_planta, obtener_equipos,
-    obtener_historial, calcular_estadisticas, obtener_estadisticas_globales
+    obtener_estadisticas_planta, obtener_estadisticas_globales
 )
 from app.routes.auth import login_required, get_current_user
+from app.services import cache
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
 API_KEY = os.environ.get("API_KEY", "clave_secreta_123")
 
+# El iframe SCADA se refresca seguido: el JSON de plantas se reutiliza unos segundos
+SCADA_TTL = 5
+
+# Plantilla SCADA renderizada una vez con marcas donde van el JSON y la api_key
+_MARCA_JSON = "@@SCADA_PLANTAS_JSON@@"
+_MARCA_API_KEY = "@@SCADA_API_KEY@@"
+_scada_partes = None
+
 
 @dashboard_bp.route('/')
 def index():
@@ -62,8 +73,7 @@ def detalle_planta(planta_id):
     
     # Estadísticas últimas 24h
     desde = (datetime.now() - timedelta(hours=24)).isoformat()
-    historial = obtener_historial(planta_id, desde=desde)
-    stats_24h = calcular_estadisticas(historial)
+    stats_24h = obtener_estadisticas_planta(planta_id, desde=desde)
     
     return render_template('dashboard/planta_detalle.html',
                            user=user,
@@ -98,27 +108,49 @@ def dashboard_scada():
         if not user:
             return "No autorizado - Usa ?api_key=TU_CLAVE o inicia sesión", 401
     
-    plantas = obtener_plantas()
+    etag, plantas_json = cache.get_or_set(
+        f"admin:plantas:scada:{cache.CACHE_VERSION}", SCADA_TTL, _scada_plantas_json
+    )
     
-    # Limpiar datos para JSON
-    plantas_clean = {}
-    for pid, p in plantas.items():
-        plantas_clean[pid] = {}
-        for k, v in p.items():
-            if hasattr(v, 'isoformat'):
-                plantas_clean[pid][k] = v.isoformat()
-            else:
-                plantas_clean[pid][k] = v
-    
-    if not plantas_clean:
+    if plantas_json is None:
         return """<html><body style='background:#0b1724;color:#fff;padding:50px;'>
                   <h2>No hay plantas registradas</h2>
                   <p>Use la API o el panel de admin para agregar plantas.</p>
                   </body></html>"""
     
-    plantas_json = json.dumps(plantas_clean)
+    # La página depende del JSON y de la api_key embebida
+    api_key = api_key or API_KEY
+    etag = hashlib.md5(f"{etag}:{api_key}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = current_app.response_class(status=304)
+    else:
+        # Template SCADA embebido: solo se sustituyen las marcas, sin pasar por Jinja
+        valores = {_MARCA_JSON: plantas_json, _MARCA_API_KEY: str(escape(api_key))}
+        html = "".join([valores.get(p, p) for p in _plantilla_scada()])
+        resp = current_app.response_class(html, mimetype='text/html')
+    
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = f"private, max-age=0, stale-while-revalidate={SCADA_TTL}"
+    return resp
+
+
+def _scada_plantas_json():
+    """(etag, JSON de plantas) para el SCADA; (None, None) si no hay plantas"""
+    plantas = obtener_plantas()
+    if not plantas:
+        return None, None
     
-    # Template SCADA embebido
-    return render_template('dashboard/scada.html', 
-                           plantas_json=plantas_json,
-                           api_key=api_key or API_KEY)
+    # El provider JSON de la app serializa las fechas (orjson si está instalado)
+    plantas_json = current_app.json.dumps(plantas)
+    return hashlib.md5(plantas_json.encode()).hexdigest(), plantas_json
+
+
+def _plantilla_scada() -> list:
+    """scada.html partido en trozos fijos y marcas (se re-renderiza siempre en debug)"""
+    global _scada_partes
+    if _scada_partes is None or current_app.debug:
+        html = render_template('dashboard/scada.html',
+                               plantas_json=_MARCA_JSON,
+                               api_key=_MARCA_API_KEY)
+        _scada_partes = re.split(f"({_MARCA_JSON}|{_MARCA_API_KEY})", html)
+    return _scada_partes
@@ -0,0 +1,222 @@
+"""
+================================================================================
+Caché compartida (cache-aside)
+Redis si REDIS_URL está configurada; si no, caché en memoria del proceso.
+Dentro de un request, flask.g actúa como L1 para no repetir lecturas.
+La invalidación solo llega a todos los workers con Redis: en memoria cada
+proceso tiene su copia, por eso ahí los TTL se acotan a CACHE_TTL_LOCAL_MAX.
+================================================================================
+"""
+
+import os
+import time
+import pickle
+import fnmatch
+import logging
+import threading
+from functools import wraps
+from typing import Any, Callable
+
+from cachetools import TTLCache
+from flask import g, has_request_context
+
+try:
+    import redis
+except ImportError:  # Redis es opcional
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.environ.get("REDIS_URL", "")
+
+# Sin Redis, un worker no ve las invalidaciones de otro: lo cacheado en
+# memoria vive como mucho estos segundos
+CACHE_TTL_LOCAL_MAX = int(os.environ.get("CACHE_TTL_LOCAL_MAX", 5))
+
+# Subir al cambiar el formato de lo que se cachea (invalida todo lo anterior)
+CACHE_VERSION = "v1"
+
+_FALTA = object()
+
+
+# ================================================================================
+# BACKENDS
+# ================================================================================
+
+class _LocalBackend:
+    """Caché en memoria del proceso con TTL por entrada"""
+
+    def __init__(self, maxsize: int = 1024):
+        self._datos = TTLCache(maxsize=maxsize, ttl=3600)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entrada = self._datos.get(key)
+        if entrada is None or entrada[0] < time.monotonic():
+            return None
+        return entrada[1]
+
+    def set(self, key: str, valor: bytes, ttl: int):
+        ttl = min(ttl, CACHE_TTL_LOCAL_MAX)
+        with self._lock:
+            self._datos[key] = (time.monotonic() + ttl, valor)
+
+    def get_many(self, keys: list) -> list:
+        return [self.get(key) for key in keys]
+
+    def set_many(self, valores: dict, ttl: int):
+        for key, valor in valores.items():
+            self.set(key, valor, ttl)
+
+    def delete(self, keys: list):
+        with self._lock:
+            for key in keys:
+                self._datos.pop(key, None)
+
+    def delete_pattern(self, patron: str):
+        with self._lock:
+            for key in [k for k in self._datos.keys() if fnmatch.fnmatchcase(k, patron)]:
+                self._datos.pop(key, None)
+
+
+class _RedisBackend:
+    """Caché compartida entre workers sobre Redis"""
+
+    def __init__(self, url: str):
+        self._r = redis.Redis.from_url(url, socket_timeout=0.5)
+
+    def get(self, key: str):
+        return self._r.get(key)
+
+    def set(self, key: str, valor: bytes, ttl: int):
+        self._r.set(key, valor, ex=ttl)
+
+    def get_many(self, keys: list) -> list:
+        return self._r.mget(keys)
+
+    def set_many(self, valores: dict, ttl: int):
+        pipe = self._r.pipeline(transaction=False)
+        for key, valor in valores.items():
+            pipe.set(key, valor, ex=ttl)
+        pipe.execute()
+
+    def delete(self, keys: list):
+        self._r.delete(*keys)
+
+    def delete_pattern(self, patron: str):
+        keys = list(self._r.scan_iter(match=patron, count=500))
+        if keys:
+            self._r.delete(*keys)
+
+
+if REDIS_URL and redis is not None:
+    _backend = _RedisBackend(REDIS_URL)
+else:
+    if REDIS_URL:
+        logger.error("REDIS_URL configurada pero el paquete redis no está instalado")
+    logger.warning(f"Caché en memoria del proceso (TTL máximo {CACHE_TTL_LOCAL_MAX}s): "
+                   "con varios workers configurar REDIS_URL")
+    _backend = _LocalBackend()
+
+
+# ================================================================================
+# API
+# ================================================================================
+
+def _l1() -> dict:
+    """Memo del request actual (vacío fuera de un request)"""
+    if not has_request_context():
+        return {}
+    if not hasattr(g, '_cache_l1'):
+        g._cache_l1 = {}
+    return g._cache_l1
+
+
+def get_or_set(key: str, ttl: int, loader: Callable[[], Any]) -> Any:
+    """Devuelve el valor cacheado o lo carga con loader() y lo guarda"""
+    l1 = _l1()
+    valor = l1.get(key, _FALTA)
+    if valor is not _FALTA:
+        return valor
+
+    try:
+        crudo = _backend.get(key)
+    except Exception as e:
+        logger.error(f"Error leyendo caché {key}: {e}")
+        crudo = None
+
+    if crudo is not None:
+        valor = pickle.loads(crudo)
+    else:
+        valor = loader()
+        try:
+            _backend.set(key, pickle.dumps(valor, pickle.HIGHEST_PROTOCOL), ttl)
+        except Exception as e:
+            logger.error(f"Error guardando caché {key}: {e}")
+
+    l1[key] = valor
+    return valor
+
+
+def get_many(keys: list) -> dict:
+    """Lee varias claves en un viaje; devuelve solo las encontradas"""
+    if not keys:
+        return {}
+    try:
+        crudos = _backend.get_many(keys)
+    except Exception as e:
+        logger.error(f"Error leyendo {len(keys)} claves de caché: {e}")
+        return {}
+    return {k: pickle.loads(c) for k, c in zip(keys, crudos) if c is not None}
+
+
+def set_many(valores: dict, ttl: int):
+    """Guarda varias claves en un viaje"""
+    if not valores:
+        return
+    try:
+        _backend.set_many(
+            {k: pickle.dumps(v, pickle.HIGHEST_PROTOCOL) for k, v in valores.items()}, ttl
+        )
+    except Exception as e:
+        logger.error(f"Error guardando {len(valores)} claves de caché: {e}")
+
+
+def delete(keys: list):
+    """Borra claves exactas (más barato que invalidate: sin SCAN en Redis)"""
+    if not keys:
+        return
+    l1 = _l1()
+    for key in keys:
+        l1.pop(key, None)
+
+    try:
+        _backend.delete(keys)
+    except Exception as e:
+        logger.error(f"Error borrando {len(keys)} claves de caché: {e}")
+
+
+def invalidate(patron: str):
+    """Borra las claves que coinciden con el patrón glob (p.ej. 'admin:plantas:*')"""
+    l1 = _l1()
+    for key in [k for k in l1 if fnmatch.fnmatchcase(k, patron)]:
+        del l1[key]
+
+    try:
+        _backend.delete_pattern(patron)
+    except Exception as e:
+        logger.error(f"Error invalidando caché {patron}: {e}")
+
+
+def cached(nombre: str, ttl: int = 60):
+    """Decorador cache-aside; la clave es admin:<nombre>:<versión>[:args...]"""
+    def decorador(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            partes = [f"admin:{nombre}:{CACHE_VERSION}"]
+            partes.extend(str(a) for a in args)
+            partes.extend(f"{k}={v}" for k, v in sorted(kwargs.items()))
+            return get_or_set(":".join(partes), ttl, lambda: func(*args, **kwargs))
+        return wrapper
+    return decorador
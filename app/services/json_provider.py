@@ -0,0 +1,80 @@
+"""
+================================================================================
+Serialización JSON de la app
+Fechas en ISO-8601 sin pre-procesar las filas. Con orjson instalado la
+serialización se hace en C; si no, ujson (donde orjson no compila, p.ej.
+PyPy); y si tampoco está, el json de la biblioteca estándar.
+================================================================================
+"""
+
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # ujson es opcional (alternativa a orjson)
+    ujson = None
+
+
+def _default(o):
+    """Tipos que el serializador no conoce (fechas como ISO en vez de HTTP-date)"""
+    if isinstance(o, date):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+class IsoJSONProvider(DefaultJSONProvider):
+    """Provider de Flask con json estándar y fechas ISO-8601"""
+    default = staticmethod(_default)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Provider de Flask sobre orjson (datetime, date y UUID se serializan en C)"""
+
+    OPCIONES = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson else 0
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=_default, option=self.OPCIONES).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            # object_hook y similares (p.ej. la cookie de sesión): json estándar
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=self.OPCIONES),
+            mimetype=self.mimetype
+        )
+
+
+class UjsonProvider(IsoJSONProvider):
+    """Provider de Flask sobre ujson (requiere ujson >= 5.4 por el parámetro default)
+
+    Solo serializa con ujson: loads queda en el json estándar porque ujson no
+    admite object_hook (lo usa la cookie de sesión).
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        return ujson.dumps(obj, default=_default, ensure_ascii=False, escape_forward_slashes=False)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps(obj), mimetype=self.mimetype)
+
+
+def crear_provider(app):
+    """Provider JSON para la app: orjson, ujson o json estándar, según lo instalado"""
+    if orjson is not None:
+        return OrjsonProvider(app)
+    if ujson is not None:
+        return UjsonProvider(app)
+    return IsoJSONProvider(app)
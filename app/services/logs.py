@@ -0,0 +1,58 @@
+"""
+================================================================================
+Configuración de logging
+Los hilos de request solo encolan el registro; un hilo aparte lo formatea y
+lo escribe, así el lock del handler y el strftime no compiten con los
+requests.
+================================================================================
+"""
+
+import os
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+FORMATO = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_handler: Optional[QueueHandler] = None
+_listener: Optional[QueueListener] = None
+_salida: Optional[logging.Handler] = None
+
+
+def _iniciar_listener():
+    """Cola nueva + hilo escritor (también tras un fork: los hilos no se heredan)"""
+    global _listener
+    _handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(_handler.queue, _salida, respect_handler_level=True)
+    _listener.start()
+
+
+def _detener_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def configurar_logging(nivel: int = logging.INFO, formato: str = FORMATO):
+    """Logging a stderr vía cola (idempotente)"""
+    global _handler, _salida
+    if _handler is not None:
+        return
+
+    # Datos por registro que no se usan en el formato
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    _salida = logging.StreamHandler()
+    _salida.setFormatter(logging.Formatter(formato))
+    _handler = QueueHandler(queue.SimpleQueue())
+    _iniciar_listener()
+
+    raiz = logging.getLogger()
+    raiz.setLevel(nivel)
+    raiz.addHandler(_handler)
+
+    atexit.register(_detener_listener)
+    os.register_at_fork(after_in_child=_iniciar_listener)
@@ -0,0 +1,168 @@
+"""
+================================================================================
+Caché de estadísticas de historial por hora
+Cada hora cerrada de una planta se guarda como agregado combinable
+(conteo, media, M2, min, max por métrica + alarmas y modos). Una ventana
+deslizante se arma combinando horas cacheadas y solo consulta SQL para los
+bordes parciales y las horas que falten.
+================================================================================
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.services import cache
+
+HORA = timedelta(hours=1)
+
+# Una hora se considera cerrada pasado este margen (writer diferido, relojes)
+MARGEN_CIERRE = timedelta(minutes=5)
+
+# Las horas cerradas no cambian: se guardan lo que cubre el período más largo
+TTL_HORA = 8 * 24 * 3600
+
+
+# ================================================================================
+# AGREGADOS
+# ================================================================================
+
+def vacio() -> Dict:
+    """Agregado neutro para combinar"""
+    return {"registros": 0, "alarmas": 0, "pureza_ok": 0, "modos": {}, "metricas": {}}
+
+
+def _combinar_metrica(a: Optional[Tuple], b: Optional[Tuple]) -> Optional[Tuple]:
+    """Combina (n, media, M2, min, max) de dos tramos (Chan et al.)"""
+    if not a or not a[0]:
+        return b
+    if not b or not b[0]:
+        return a
+    na, ma, m2a, mina, maxa = a
+    nb, mb, m2b, minb, maxb = b
+    n = na + nb
+    delta = mb - ma
+    return (
+        n,
+        ma + delta * nb / n,
+        m2a + m2b + delta * delta * na * nb / n,
+        min(mina, minb),
+        max(maxa, maxb),
+    )
+
+
+def combinar(a: Dict, b: Dict) -> Dict:
+    """Suma dos agregados en uno nuevo"""
+    modos = dict(a["modos"])
+    for modo, n in b["modos"].items():
+        modos[modo] = modos.get(modo, 0) + n
+
+    return {
+        "registros": a["registros"] + b["registros"],
+        "alarmas": a["alarmas"] + b["alarmas"],
+        "pureza_ok": a["pureza_ok"] + b["pureza_ok"],
+        "modos": modos,
+        "metricas": {
+            m: _combinar_metrica(a["metricas"].get(m), b["metricas"].get(m))
+            for m in a["metricas"].keys() | b["metricas"].keys()
+        },
+    }
+
+
+def _stats_metrica(metrica: Optional[Tuple]) -> Dict:
+    """Formato min/max/avg/std/count de calcular_estadisticas"""
+    if not metrica or not metrica[0]:
+        return {"min": 0, "max": 0, "avg": 0, "std": 0, "count": 0}
+    n, media, m2, minimo, maximo = metrica
+    return {
+        "min": round(minimo, 2),
+        "max": round(maximo, 2),
+        "avg": round(media, 2),
+        "std": round((m2 / (n - 1)) ** 0.5, 2) if n > 1 else 0,
+        "count": n
+    }
+
+
+def a_estadisticas(agregado: Dict, metricas) -> Dict:
+    """Convierte un agregado al resultado de obtener_estadisticas_planta"""
+    registros = agregado["registros"]
+    if not registros:
+        return {}
+
+    modos = agregado["modos"]
+    resultado = {"periodo": {"registros": registros}}
+    resultado.update((m, _stats_metrica(agregado["metricas"].get(m))) for m in metricas)
+    resultado.update({
+        "alarmas": {"total": agregado["alarmas"]},
+        "modos": modos,
+        "kpis": {
+            "disponibilidad": round(modos.get("Producción", 0) / registros * 100, 2),
+            "cumplimiento_pureza": round(agregado["pureza_ok"] / registros * 100, 2)
+        }
+    })
+    return resultado
+
+
+# ================================================================================
+# VENTANAS Y CLAVES
+# ================================================================================
+
+def _parsear(valor: Optional[str], fin_de_dia: bool = False) -> Optional[datetime]:
+    """Fecha del query string a datetime (None si no se puede)"""
+    if not valor:
+        return None
+    if len(valor) == 10:
+        valor += "T23:59:59" if fin_de_dia else "T00:00:00"
+    try:
+        fecha = datetime.fromisoformat(valor)
+    except ValueError:
+        return None
+    return fecha if fecha.tzinfo is None else None
+
+
+def horas_completas(desde: Optional[str], hasta: Optional[str],
+                    ahora: datetime = None) -> List[datetime]:
+    """Horas cerradas que la ventana [desde, hasta] cubre enteras"""
+    inicio = _parsear(desde)
+    if inicio is None or (hasta and _parsear(hasta, True) is None):
+        return []
+
+    limite = (ahora or datetime.now()) - MARGEN_CIERRE
+    fin = _parsear(hasta, True)
+    if fin is not None:
+        limite = min(limite, fin)
+
+    hora = inicio.replace(minute=0, second=0, microsecond=0)
+    if hora < inicio:
+        hora += HORA
+
+    horas = []
+    while hora + HORA <= limite:
+        horas.append(hora)
+        hora += HORA
+    return horas
+
+
+def _clave(planta_id: str, hora: datetime) -> str:
+    return f"stats:{cache.CACHE_VERSION}:{planta_id}:{hora:%Y%m%d%H}"
+
+
+def leer(planta_id: str, horas: List[datetime]) -> Dict[datetime, Dict]:
+    """Agregados cacheados de las horas pedidas"""
+    claves = {_clave(planta_id, h): h for h in horas}
+    return {claves[k]: v for k, v in cache.get_many(list(claves)).items()}
+
+
+def guardar(planta_id: str, agregados: Dict[datetime, Dict]):
+    """Cachea agregados de horas cerradas"""
+    cache.set_many({_clave(planta_id, h): a for h, a in agregados.items()}, TTL_HORA)
+
+
+def registrar_muestras(muestras: Iterable[Tuple[str, datetime]], ahora: datetime = None):
+    """Tras escribir historial: invalida horas cerradas que recibieron muestras tardías"""
+    cerrado = (ahora or datetime.now()) - MARGEN_CIERRE
+    claves = {
+        _clave(planta_id, ts.replace(minute=0, second=0, microsecond=0))
+        for planta_id, ts in muestras
+        if ts.replace(minute=0, second=0, microsecond=0) + HORA <= cerrado
+    }
+    cache.delete(list(claves))
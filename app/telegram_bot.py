@@ -5,6 +5,8 @@ Bot de Telegram - Integración con PSA Monitor
 """
 
 import os
+import time
+import asyncio
 import logging
 from datetime import datetime, timedelta
 from typing import Optional
@@ -15,9 +17,15 @@ from telegram.ext import (
     MessageHandler, filters, ContextTypes
 )
 
+try:
+    import h2  # noqa: F401  (httpx[http2])
+    _HTTP_VERSION = "2"
+except ImportError:  # HTTP/2 es opcional
+    _HTTP_VERSION = "1.1"
+
 from app.database import (
     obtener_plantas, obtener_planta, obtener_equipos,
-    obtener_historial, calcular_estadisticas,
+    obtener_estadisticas_planta,
     obtener_usuario_por_telegram, crear_usuario, actualizar_usuario
 )
 
@@ -27,6 +35,26 @@ logger = logging.getLogger(__name__)
 TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN", "")
 ADMIN_PRINCIPAL_ID = int(os.environ.get("ADMIN_PRINCIPAL_ID", "0"))
 
+# Períodos de /stats -> horas
+_PERIODO_HORAS = {'1h': 1, '6h': 6, '24h': 24, '7d': 168}
+
+# Mensajes de alerta en vuelo a la vez
+ALERTAS_CONCURRENCIA = 25
+
+# Conexiones HTTP compartidas por todos los handlers hacia la API de Telegram
+TELEGRAM_POOL_SIZE = int(os.environ.get("TELEGRAM_POOL_SIZE", "128"))
+
+# Webhook (si está configurado, reemplaza al polling); el secreto es obligatorio
+TELEGRAM_WEBHOOK_URL = os.environ.get("TELEGRAM_WEBHOOK_URL", "")
+TELEGRAM_WEBHOOK_SECRET = os.environ.get("TELEGRAM_WEBHOOK_SECRET", "")
+
+# Long polling: segundos que Telegram retiene cada getUpdates sin novedades
+POLL_TIMEOUT = 30
+
+# Bot en ejecución en este proceso y su loop (para entregar updates del webhook)
+_bot_app: Optional[Application] = None
+_bot_loop: Optional[asyncio.AbstractEventLoop] = None
+
 
 # ================================================================================
 # DECORADORES
@@ -146,9 +174,9 @@ async def cmd_ayuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ("➕ /autorizar [id]", "Autorizar nuevo usuario"),
         ])
     
-    texto = "📖 *Comandos disponibles:*\n\n"
-    for cmd, desc in comandos:
-        texto += f"{cmd}\n    _{desc}_\n"
+    texto = "📖 *Comandos disponibles:*\n\n" + "".join(
+        f"{cmd}\n    _{desc}_\n" for cmd, desc in comandos
+    )
     
     await update.message.reply_text(texto, parse_mode='Markdown')
 
@@ -157,51 +185,79 @@ async def cmd_ayuda(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # COMANDOS DE MONITOREO
 # ================================================================================
 
+# Ícono por (alarma, en producción): la alarma manda sobre el modo
+_ICONOS_ESTADO = ("🟡", "🟢", "🔴", "🔴")
+
+
+def _icono_estado(planta: dict) -> str:
+    """🔴 alarma, 🟢 produciendo, 🟡 cualquier otro modo"""
+    return _ICONOS_ESTADO[(bool(planta.get('alarma')) << 1) | (planta.get('modo') == 'Producción')]
+
+
+# Texto y botones de /estado, compartidos por todos los usuarios durante unos segundos
+ESTADO_TTL = 5
+_estado_cache = (0.0, None)
+
+
+def _payload_estado():
+    """(texto, botones) del estado general; None si no hay plantas"""
+    global _estado_cache
+    creado, payload = _estado_cache
+    if time.monotonic() - creado < ESTADO_TTL:
+        return payload
+    
+    plantas = obtener_plantas()
+    if not plantas:
+        payload = None
+    else:
+        # Una sola pasada: texto, alarmas y botones (de a 2 por fila)
+        partes = ["🏥 *Estado de Plantas PSA*\n\n"]
+        alarmas = []
+        keyboard = []
+        row = []
+        for planta_id, p in plantas.items():
+            nombre = p.get('nombre')
+            estado_icon = _icono_estado(p)
+            pureza = p.get('pureza_pct', 0) or 0
+            flujo = p.get('flujo_nm3h', 0) or 0
+            
+            partes.append(
+                f"{estado_icon} *{nombre}*\n"
+                f"    O₂: {pureza:.1f}% | Flujo: {flujo:.1f} Nm³/h\n"
+                f"    Modo: {p.get('modo', 'Desconocido')}\n"
+            )
+            if p.get('alarma'):
+                alarmas.append(f"⚠️ {nombre}: {p.get('mensaje_alarma', 'Alarma')}\n")
+            
+            row.append(InlineKeyboardButton(p.get('nombre', planta_id)[:15], callback_data=f"planta_{planta_id}"))
+            if len(row) == 2:
+                keyboard.append(row)
+                row = []
+        if row:
+            keyboard.append(row)
+        
+        if alarmas:
+            partes.append("\n🚨 *ALARMAS ACTIVAS:*\n")
+            partes.extend(alarmas)
+        texto = "".join(partes)
+        
+        payload = (texto, InlineKeyboardMarkup(keyboard) if keyboard else None)
+    
+    _estado_cache = (time.monotonic(), payload)
+    return payload
+
+
 @requiere_auth
 async def cmd_estado(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /estado - Ver estado de todas las plantas"""
-    plantas = obtener_plantas()
+    payload = _payload_estado()
     
-    if not plantas:
+    if not payload:
         await update.message.reply_text("ℹ️ No hay plantas registradas.")
         return
     
-    texto = "🏥 *Estado de Plantas PSA*\n\n"
-    
-    alarmas = []
-    for planta_id, p in plantas.items():
-        estado_icon = "🔴" if p.get('alarma') else ("🟢" if p.get('modo') == 'Producción' else "🟡")
-        pureza = p.get('pureza_pct', 0) or 0
-        flujo = p.get('flujo_nm3h', 0) or 0
-        
-        texto += f"{estado_icon} *{p.get('nombre')}*\n"
-        texto += f"    O₂: {pureza:.1f}% | Flujo: {flujo:.1f} Nm³/h\n"
-        texto += f"    Modo: {p.get('modo', 'Desconocido')}\n"
-        
-        if p.get('alarma'):
-            alarmas.append(f"⚠️ {p.get('nombre')}: {p.get('mensaje_alarma', 'Alarma')}")
-    
-    if alarmas:
-        texto += "\n🚨 *ALARMAS ACTIVAS:*\n"
-        for a in alarmas:
-            texto += f"{a}\n"
-    
-    # Botones para cada planta
-    keyboard = []
-    row = []
-    for planta_id, p in plantas.items():
-        row.append(InlineKeyboardButton(p.get('nombre', planta_id)[:15], callback_data=f"planta_{planta_id}"))
-        if len(row) == 2:
-            keyboard.append(row)
-            row = []
-    if row:
-        keyboard.append(row)
-    
-    await update.message.reply_text(
-        texto,
-        parse_mode='Markdown',
-        reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
-    )
+    texto, markup = payload
+    await update.message.reply_text(texto, parse_mode='Markdown', reply_markup=markup)
 
 
 @requiere_auth
@@ -239,7 +295,7 @@ async def mostrar_planta(update: Update, planta_id: str, edit: bool = False):
             await update.message.reply_text(msg)
         return
     
-    estado_icon = "🔴" if planta.get('alarma') else ("🟢" if planta.get('modo') == 'Producción' else "🟡")
+    estado_icon = _icono_estado(planta)
     
     texto = f"{estado_icon} *{planta.get('nombre')}*\n"
     texto += f"📍 {planta.get('ubicacion') or planta.get('ciudad') or 'Sin ubicación'}\n\n"
@@ -315,11 +371,10 @@ async def mostrar_stats(update: Update, planta_id: str, periodo: str, edit: bool
         return
     
     # Calcular rango de fechas
-    horas = {'1h': 1, '6h': 6, '24h': 24, '7d': 168}.get(periodo, 24)
+    horas = _PERIODO_HORAS.get(periodo, 24)
     desde = (datetime.now() - timedelta(hours=horas)).isoformat()
     
-    datos = obtener_historial(planta_id, desde=desde)
-    stats = calcular_estadisticas(datos)
+    stats = obtener_estadisticas_planta(planta_id, desde=desde)
     
     if not stats:
         msg = f"ℹ️ Sin datos para el período seleccionado."
@@ -400,21 +455,24 @@ async def mostrar_equipos(update: Update, planta_id: str, edit: bool = False):
     
     equipos = obtener_equipos(planta_id)
     
-    texto = f"⚙️ *Equipos: {planta.get('nombre')}*\n"
-    texto += f"📍 Tipo: {planta.get('tipo_instalacion', 'simplex').capitalize()}\n\n"
+    partes = [
+        f"⚙️ *Equipos: {planta.get('nombre')}*\n",
+        f"📍 Tipo: {planta.get('tipo_instalacion', 'simplex').capitalize()}\n\n",
+    ]
     
     if not equipos:
-        texto += "ℹ️ No hay equipos registrados."
+        partes.append("ℹ️ No hay equipos registrados.")
     else:
         for eq in equipos:
             estado_icon = "🟢" if eq.get('estado') == 'operativo' else "🟡" if eq.get('estado') == 'standby' else "🔴"
-            texto += f"{eq.get('tipo_icono', '⚙️')} *{eq.get('nombre')}*\n"
-            texto += f"    {estado_icon} {eq.get('estado', 'N/A')}"
+            partes.append(f"{eq.get('tipo_icono', '⚙️')} *{eq.get('nombre')}*\n")
+            partes.append(f"    {estado_icon} {eq.get('estado', 'N/A')}")
             if eq.get('marca') or eq.get('modelo'):
-                texto += f" | {eq.get('marca', '')} {eq.get('modelo', '')}"
-            texto += "\n"
+                partes.append(f" | {eq.get('marca', '')} {eq.get('modelo', '')}")
+            partes.append("\n")
             if eq.get('numero_patrimonio'):
-                texto += f"    📋 Patr: {eq.get('numero_patrimonio')}\n"
+                partes.append(f"    📋 Patr: {eq.get('numero_patrimonio')}\n")
+    texto = "".join(partes)
     
     keyboard = [[InlineKeyboardButton("« Volver", callback_data=f"planta_{planta_id}")]]
     
@@ -441,15 +499,16 @@ async def cmd_usuarios(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     usuarios = listar_usuarios()
     
-    texto = "👥 *Usuarios del sistema:*\n\n"
+    partes = ["👥 *Usuarios del sistema:*\n\n"]
     
     for u in usuarios:
         rol_icon = "👑" if u.get('rol') == 'admin' else "🔧" if u.get('rol') == 'operador' else "👁"
         estado = "✅" if u.get('activo') else "❌"
-        texto += f"{rol_icon} {estado} *{u.get('username')}*"
+        partes.append(f"{rol_icon} {estado} *{u.get('username')}*")
         if u.get('telegram_id'):
-            texto += f" (TG: {u.get('telegram_id')})"
-        texto += f"\n    Rol: {u.get('rol')}\n"
+            partes.append(f" (TG: {u.get('telegram_id')})")
+        partes.append(f"\n    Rol: {u.get('rol')}\n")
+    texto = "".join(partes)
     
     await update.message.reply_text(texto, parse_mode='Markdown')
 
@@ -518,43 +577,46 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("⚠️ No autorizado.")
         return
     
-    if data == "estado":
-        # Volver al estado general
-        plantas = obtener_plantas()
-        texto = "🏥 *Estado de Plantas PSA*\n\n"
-        
-        for planta_id, p in plantas.items():
-            estado_icon = "🔴" if p.get('alarma') else ("🟢" if p.get('modo') == 'Producción' else "🟡")
-            texto += f"{estado_icon} *{p.get('nombre')}*: {p.get('pureza_pct', 0):.1f}%\n"
-        
-        keyboard = []
-        row = []
-        for planta_id, p in plantas.items():
-            row.append(InlineKeyboardButton(p.get('nombre', planta_id)[:15], callback_data=f"planta_{planta_id}"))
-            if len(row) == 2:
-                keyboard.append(row)
-                row = []
-        if row:
-            keyboard.append(row)
-        
-        await query.edit_message_text(
-            texto, parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
-        )
-    
-    elif data.startswith("planta_"):
-        planta_id = data.replace("planta_", "")
-        await mostrar_planta(update, planta_id, edit=True)
-    
-    elif data.startswith("stats_"):
-        parts = data.split("_")
-        planta_id = parts[1]
-        periodo = parts[2] if len(parts) > 2 else '24h'
-        await mostrar_stats(update, planta_id, periodo, edit=True)
+    accion, _, resto = data.partition("_")
+    handler = _CALLBACKS.get(accion)
+    if handler:
+        await handler(update, resto)
+
+
+async def _cb_estado(update: Update, resto: str):
+    """Volver al estado general"""
+    payload = _payload_estado()
+    if not payload:
+        await update.callback_query.edit_message_text("ℹ️ No hay plantas registradas.")
+        return
     
-    elif data.startswith("equipos_"):
-        planta_id = data.replace("equipos_", "")
-        await mostrar_equipos(update, planta_id, edit=True)
+    texto, markup = payload
+    await update.callback_query.edit_message_text(texto, parse_mode='Markdown', reply_markup=markup)
+
+
+async def _cb_planta(update: Update, planta_id: str):
+    await mostrar_planta(update, planta_id, edit=True)
+
+
+async def _cb_stats(update: Update, resto: str):
+    # stats_<planta>_<periodo>; el id de planta puede contener "_"
+    planta_id, _, periodo = resto.rpartition("_")
+    if periodo not in _PERIODO_HORAS:
+        planta_id, periodo = resto, '24h'
+    await mostrar_stats(update, planta_id, periodo, edit=True)
+
+
+async def _cb_equipos(update: Update, planta_id: str):
+    await mostrar_equipos(update, planta_id, edit=True)
+
+
+# Prefijo de callback_data -> handler (una búsqueda por botón)
+_CALLBACKS = {
+    "estado": _cb_estado,
+    "planta": _cb_planta,
+    "stats": _cb_stats,
+    "equipos": _cb_equipos,
+}
 
 
 # ================================================================================
@@ -563,9 +625,9 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def enviar_alerta(app: Application, planta: dict, mensaje: str):
     """Envía alerta a usuarios con rol admin/operador"""
-    from app.database import listar_usuarios
+    from app.database import listar_usuarios_notificables
     
-    usuarios = listar_usuarios()
+    usuarios = listar_usuarios_notificables()
     
     texto = f"🚨 *ALERTA - {planta.get('nombre')}*\n\n"
     texto += f"📍 {planta.get('ubicacion', '')}\n"
@@ -575,16 +637,21 @@ async def enviar_alerta(app: Application, planta: dict, mensaje: str):
     texto += f"• Presión: {planta.get('presion_bar', 0):.1f} bar\n"
     texto += f"• Temperatura: {planta.get('temperatura_c', 0):.1f}°C"
     
-    for u in usuarios:
-        if u.get('telegram_id') and u.get('rol') in ['admin', 'operador'] and u.get('activo'):
-            try:
-                await app.bot.send_message(
-                    chat_id=u['telegram_id'],
-                    text=texto,
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                logger.error(f"Error enviando alerta a {u.get('username')}: {e}")
+    # Envíos concurrentes, acotados para no pasar el límite de Telegram (~30 msg/s)
+    limite = asyncio.Semaphore(ALERTAS_CONCURRENCIA)
+    
+    async def enviar(u):
+        async with limite:
+            await app.bot.send_message(
+                chat_id=u['telegram_id'],
+                text=texto,
+                parse_mode='Markdown'
+            )
+    
+    resultados = await asyncio.gather(*(enviar(u) for u in usuarios), return_exceptions=True)
+    for u, resultado in zip(usuarios, resultados):
+        if isinstance(resultado, Exception):
+            logger.error(f"Error enviando alerta a {u.get('username')}: {resultado}")
 
 
 # ================================================================================
@@ -597,7 +664,16 @@ def crear_bot_application() -> Optional[Application]:
         logger.warning("TELEGRAM_TOKEN no configurado - Bot deshabilitado")
         return None
     
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .connection_pool_size(TELEGRAM_POOL_SIZE)
+        .pool_timeout(30.0)
+        .connect_timeout(10.0)
+        .read_timeout(10.0)
+        .http_version(_HTTP_VERSION)
+        .build()
+    )
     
     # Comandos
     app.add_handler(CommandHandler("start", cmd_start))
@@ -617,13 +693,37 @@ def crear_bot_application() -> Optional[Application]:
     return app
 
 
-async def iniciar_bot_polling():
-    """Inicia el bot en modo polling"""
+async def iniciar_bot() -> Optional[Application]:
+    """Inicia el bot: webhook si TELEGRAM_WEBHOOK_URL está configurada, si no long polling"""
+    global _bot_app, _bot_loop
     app = crear_bot_application()
-    if app:
-        await app.initialize()
-        await app.start()
-        await app.updater.start_polling(drop_pending_updates=True)
+    if not app:
+        return None
+    
+    await app.initialize()
+    await app.start()
+    # Antes de set_webhook: Telegram puede entregar el primer update enseguida
+    _bot_app, _bot_loop = app, asyncio.get_running_loop()
+    
+    if TELEGRAM_WEBHOOK_URL and TELEGRAM_WEBHOOK_SECRET:
+        await app.bot.set_webhook(TELEGRAM_WEBHOOK_URL, secret_token=TELEGRAM_WEBHOOK_SECRET,
+                                  drop_pending_updates=True)
+        logger.info("Bot de Telegram iniciado en modo webhook")
+    else:
+        if TELEGRAM_WEBHOOK_URL:
+            logger.error("TELEGRAM_WEBHOOK_URL sin TELEGRAM_WEBHOOK_SECRET - se usa polling")
+        await app.updater.start_polling(drop_pending_updates=True, timeout=POLL_TIMEOUT)
         logger.info("Bot de Telegram iniciado en modo polling")
-        return app
-    return None
+    
+    return app
+
+
+def encolar_update(datos: dict) -> bool:
+    """Entrega al loop del bot un update recibido por webhook (False si el bot no corre aquí)"""
+    if _bot_app is None:
+        return False
+    
+    update = Update.de_json(datos, _bot_app.bot)
+    asyncio.run_coroutine_threadsafe(_bot_app.update_queue.put(update), _bot_loop)
+    return True
+
@@ -0,0 +1,18 @@
+"""
+Hooks de Gunicorn (se carga solo desde el directorio del proyecto)
+"""
+
+
+def post_fork(server, worker):
+    """Abre el pool PostgreSQL del worker antes de aceptar requests
+
+    Con --preload el pool del master no sirve en los workers; sin este hook
+    el primer request de cada worker paga la conexión y autenticación de
+    las PG_POOL_MIN conexiones iniciales.
+    """
+    from app.database import init_pool
+
+    try:
+        init_pool()
+    except Exception as e:
+        server.log.error(f"Error precalentando el pool PostgreSQL: {e}")
@@ -22,46 +22,39 @@ import os
 import sys
 import logging
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+from app.services.logs import configurar_logging
 
+# Configurar logging (escritura en un hilo aparte)
+configurar_logging()
+logger = logging.getLogger(__name__)
 
-def create_admin_user():
-    """Crea usuario admin por defecto si no existe"""
-    from app.database import get_db, crear_usuario
-    
-    try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id FROM usuarios WHERE username = 'admin'")
-            if not cursor.fetchone():
-                # Crear admin con contraseña por defecto
-                admin_password = os.environ.get('ADMIN_PASSWORD', 'admin123')
-                user_id = crear_usuario(
-                    username='admin',
-                    password=admin_password,
-                    rol='admin',
-                    nombre_completo='Administrador'
-                )
-                if user_id:
-                    logger.info(f"Usuario admin creado (password: {admin_password})")
-                    logger.warning("¡CAMBIA LA CONTRASEÑA DEL ADMIN!")
-    except Exception as e:
-        logger.error(f"Error creando admin: {e}")
+# Configuración (se lee una vez al importar)
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
+PORT = int(os.environ.get('PORT', 5000))
+DEBUG = os.environ.get('FLASK_ENV') == 'development'
+TELEGRAM_TOKEN = os.environ.get('TELEGRAM_TOKEN', '')
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+# En desarrollo el reloader de Werkzeug relanza main.py en un hijo; el proceso
+# vigilante no debe inicializar la BD ni arrancar el bot (lo hace el hijo)
+VIGILANTE_RELOADER = DEBUG and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
 
 
 def main():
     """Punto de entrada principal"""
     
     # Verificar variables de entorno críticas
-    if not os.environ.get('DATABASE_URL'):
+    if not DATABASE_URL:
         logger.error("DATABASE_URL no configurada")
         sys.exit(1)
     
+    if VIGILANTE_RELOADER:
+        # Solo relanza el hijo al cambiar el código: no necesita la app real
+        # (ni importar app.database ni abrir conexiones)
+        from flask import Flask
+        Flask(__name__).run(host='0.0.0.0', port=PORT, debug=True)
+        return
+    
     # Importar después de verificar
     from app import create_app
     from app.database import inicializar_db
@@ -69,49 +62,27 @@ def main():
     # Crear aplicación
     app = create_app()
     
-    # Inicializar base de datos
-    logger.info("Inicializando base de datos...")
-    try:
-        inicializar_db()
-        logger.info("Base de datos lista")
-    except Exception as e:
-        logger.error(f"Error inicializando DB: {e}")
-        sys.exit(1)
-    
-    # Crear usuario admin si no existe
-    create_admin_user()
-    
-    # Configurar puerto
-    port = int(os.environ.get('PORT', 5000))
-    debug = os.environ.get('FLASK_ENV') == 'development'
-    
-    logger.info(f"Iniciando servidor en puerto {port}...")
-    logger.info(f"Dashboard: http://localhost:{port}/")
-    logger.info(f"API: http://localhost:{port}/api/")
-    logger.info(f"SCADA: http://localhost:{port}/scada")
-    
-    # Iniciar bot de Telegram si está configurado
-    telegram_token = os.environ.get('TELEGRAM_TOKEN')
-    if telegram_token:
+    # Iniciar bot de Telegram si está configurado (su arranque contra la API de
+    # Telegram se solapa con la inicialización de la base de datos)
+    if TELEGRAM_TOKEN:
         import threading
         import asyncio
-        from app.telegram_bot import crear_bot_application
+        from app.telegram_bot import iniciar_bot
         
         def run_bot():
             """Ejecuta el bot en un thread separado"""
-            loop = asyncio.new_event_loop()
+            try:
+                import uvloop
+                loop = uvloop.new_event_loop()
+            except ImportError:  # uvloop es opcional (no existe en Windows)
+                loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             
-            bot_app = crear_bot_application()
-            if bot_app:
-                try:
-                    loop.run_until_complete(bot_app.initialize())
-                    loop.run_until_complete(bot_app.start())
-                    loop.run_until_complete(bot_app.updater.start_polling(drop_pending_updates=True))
-                    logger.info("Bot de Telegram iniciado")
+            try:
+                if loop.run_until_complete(iniciar_bot()):
                     loop.run_forever()
-                except Exception as e:
-                    logger.error(f"Error en bot de Telegram: {e}")
+            except Exception as e:
+                logger.error(f"Error en bot de Telegram: {e}")
         
         bot_thread = threading.Thread(target=run_bot, daemon=True)
         bot_thread.start()
@@ -119,12 +90,36 @@ def main():
     else:
         logger.info("Bot de Telegram no configurado (sin TELEGRAM_TOKEN)")
     
-    # Ejecutar servidor Flask
-    app.run(
-        host='0.0.0.0',
-        port=port,
-        debug=debug
-    )
+    # Inicializar base de datos
+    logger.info("Inicializando base de datos...")
+    try:
+        # Tablas + usuario admin por defecto (si no existe)
+        inicializar_db(admin_password=ADMIN_PASSWORD)
+        logger.info("Base de datos lista")
+    except Exception as e:
+        logger.error(f"Error inicializando DB: {e}")
+        sys.exit(1)
+    
+    logger.info("Iniciando servidor en puerto %d...", PORT)
+    logger.info("Dashboard: http://localhost:%d/", PORT)
+    logger.info("API: http://localhost:%d/api/", PORT)
+    logger.info("SCADA: http://localhost:%d/scada", PORT)
+    
+    if DEBUG:
+        # Servidor de desarrollo de Flask (recarga y debugger)
+        app.run(host='0.0.0.0', port=PORT, debug=True)
+        return
+    
+    # Servidor WSGI de producción con hilos, en este mismo proceso (junto al bot)
+    try:
+        from waitress import serve
+    except ImportError:
+        logger.warning("waitress no instalado - usando el servidor de desarrollo de Flask")
+        app.run(host='0.0.0.0', port=PORT, threaded=True)
+        return
+    
+    logger.info("Servidor waitress con %d hilos", WEB_THREADS)
+    serve(app, host='0.0.0.0', port=PORT, threads=WEB_THREADS)
 
 
 if __name__ == '__main__':
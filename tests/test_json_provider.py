@@ -0,0 +1,33 @@
+"""
+Providers JSON: la cookie de sesión (flashes) debe sobrevivir ida y vuelta
+"""
+
+import pytest
+from flask import Flask
+
+from app.services import json_provider
+from app.services.json_provider import IsoJSONProvider, OrjsonProvider, UjsonProvider
+
+PROVIDERS = [
+    IsoJSONProvider,
+    pytest.param(OrjsonProvider, marks=pytest.mark.skipif(
+        json_provider.orjson is None, reason="orjson no instalado")),
+    pytest.param(UjsonProvider, marks=pytest.mark.skipif(
+        json_provider.ujson is None, reason="ujson no instalado")),
+]
+
+
+@pytest.mark.parametrize("provider", PROVIDERS)
+def test_flashes_en_sesion(provider):
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.json = provider(app)
+    serializer = app.session_interface.get_signing_serializer(app)
+    
+    flashes = [("success", "Planta creada"), ("error", "Sin permisos")]
+    cookie = serializer.dumps({"_flashes": flashes})
+    sesion = serializer.loads(cookie)
+    
+    assert sesion["_flashes"] == flashes
+    for categoria, mensaje in sesion["_flashes"]:
+        assert isinstance(categoria, str) and isinstance(mensaje, str)
@@ -5,28 +5,31 @@ WSGI Entry Point para Gunicorn/Producción
 import os
 import logging
 
-logging.basicConfig(level=logging.INFO)
+from app import create_app
+from app.database import inicializar_db, cerrar_pool
+from app.services.logs import configurar_logging
+
+configurar_logging()
 logger = logging.getLogger(__name__)
 
-from app import create_app
-from app.database import inicializar_db, get_db, crear_usuario
+ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
 
 # Crear aplicación
 app = create_app()
 
-# Inicializar base de datos al arrancar
+# El bot de Telegram solo corre con main.py; aquí el webhook no tiene quién lo atienda
+if os.environ.get('TELEGRAM_WEBHOOK_URL'):
+    logger.error("TELEGRAM_WEBHOOK_URL configurada pero gunicorn no arranca el bot: "
+                 "usar `python main.py` o quitar la variable")
+
+# Inicializar base de datos (y admin si no existe) al arrancar
 with app.app_context():
     try:
-        inicializar_db()
+        inicializar_db(admin_password=ADMIN_PASSWORD)
         logger.info("Base de datos inicializada")
-        
-        # Crear admin si no existe
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id FROM usuarios WHERE username = 'admin'")
-            if not cursor.fetchone():
-                admin_password = os.environ.get('ADMIN_PASSWORD', 'admin123')
-                crear_usuario('admin', admin_password, 'admin', nombre_completo='Administrador')
-                logger.info("Usuario admin creado")
     except Exception as e:
         logger.error(f"Error en inicialización: {e}")
+    finally:
+        # Con --preload esto corre en el master, que no atiende requests:
+        # no se queda con conexiones (cada worker abre su pool en post_fork)
+        cerrar_pool()